@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Time the rst filter against docutils.core.publish_parts(), which it used to
+call for every post, and check that both produce the same HTML.
+
+Usage: python bench/rst_filter.py [POST ...]
+
+POST is a post file (front matter is skipped) or a site directory, whose
+_posts/*.rst are used.  With no arguments a sample of generated posts is
+used: short posts, and posts with many literal blocks.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+import docutils.core
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from zeekofile._filters import rst_template  # noqa: E402
+
+SHORT_POST = """\
+A heading
+=========
+
+Some *emphasis*, some **strong** text and a `link
+<http://example.com/%(n)d>`_.
+
+A section
+---------
+
+- one
+- two
+- three
+
+A paragraph with ``inline literal`` text, number %(n)d.
+"""
+
+CODE_BLOCK = """\
+Step %(n)d::
+
+    def step_%(n)d(x):
+        return x * %(n)d
+
+"""
+
+
+def sample_posts():
+    short = [SHORT_POST % {"n": n} for n in range(20)]
+    code_heavy = [
+        "".join(CODE_BLOCK % {"n": n} for n in range(200)) for i in range(2)
+    ]
+    return [("short", short), ("code-heavy", code_heavy)]
+
+
+def read_post(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.startswith("---"):
+        text = text.split("---\n", 2)[2]
+    return text
+
+
+def given_posts(paths):
+    posts = []
+    for path in paths:
+        if os.path.isdir(path):
+            posts.extend(
+                read_post(p)
+                for p in sorted(
+                    glob.glob(os.path.join(path, "_posts", "*.rst"))
+                )
+            )
+        else:
+            posts.append(read_post(path))
+    return [("given", posts)]
+
+
+def publish_parts(content, initial_header_level):
+    return docutils.core.publish_parts(
+        content,
+        writer_name="html",
+        settings_overrides={"initial_header_level": initial_header_level},
+    )["html_body"]
+
+
+def reused_publisher(content, initial_header_level):
+    return rst_template.run(content, initial_header_level)
+
+
+def time_per_post(render, posts, level, repeat):
+    render(posts[0], level)
+    start = time.perf_counter()
+    for i in range(repeat):
+        for content in posts:
+            render(content, level)
+    return (time.perf_counter() - start) / (repeat * len(posts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("posts", nargs="*", metavar="POST")
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=5,
+        help="times to render each post (default 5)",
+    )
+    args = parser.parse_args()
+    samples = given_posts(args.posts) if args.posts else sample_posts()
+
+    print("docutils %s" % docutils.__version__)
+    print(
+        "{0:20} {1:>5} {2:>14} {3:>14}".format(
+            "posts", "level", "publish_parts", "Publisher"
+        )
+    )
+    for name, posts in samples:
+        if not posts:
+            continue
+        for level in (1, 2):
+            for content in posts:
+                if publish_parts(content, level) != reused_publisher(
+                    content, level
+                ):
+                    sys.exit("Output differs for a %s post" % name)
+            before = time_per_post(publish_parts, posts, level, args.repeat)
+            after = time_per_post(reused_publisher, posts, level, args.repeat)
+            print(
+                "{0:20} {1:>5} {2:>11.2f} ms {3:>11.2f} ms".format(
+                    "%s (%d)" % (name, len(posts)),
+                    level,
+                    before * 1000,
+                    after * 1000,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
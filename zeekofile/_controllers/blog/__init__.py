@@ -7,6 +7,7 @@ from . import chronological
 from . import feed
 from . import permapage
 from . import post
+from . import tags
 
 config = {
     "name": "Blog",
@@ -22,6 +23,12 @@ def run():
 
     # Parse the posts
     blog.posts = post.parse_posts("_posts")
+    # Any page may list the posts, so the set of posts and their order is
+    # an input to every output; a post's metadata and content are only
+    # inputs to the outputs that read them
+    zf.writer.manifest.add_input("posts", [p.filename for p in blog.posts])
+    zf.writer.manifest.add_sources(p.source_digest for p in blog.posts)
+    zf.writer.manifest.add_sources(p.meta_digest for p in blog.posts)
     blog.dir = zf.util.path_join(zf.writer.output_dir, blog.path)
 
     # Find all the categories and archives before we write any pages
@@ -35,8 +42,18 @@ def run():
     # [("Category 1",num_in_category_1), ...]
     # (sorted alphabetically)
     blog.all_categories = []
+    # "tag" -> [post, post, ... ]
+    blog.tagged_posts = {}
+    # [("tag 1", num_with_tag_1), ...]
+    # (sorted alphabetically)
+    blog.all_tags = []
     archives.sort_into_archives()
     categories.sort_into_categories()
+    # the archive, category and tag lists can go on any page too
+    zf.writer.manifest.add_input(
+        "post_lists",
+        [blog.archive_links, blog.all_categories, blog.all_tags],
+    )
 
     blog.logger = logging.getLogger(config["name"])
 
@@ -44,4 +61,5 @@ def run():
     chronological.run()
     archives.run()
     categories.run()
+    tags.run()
     feed.run()
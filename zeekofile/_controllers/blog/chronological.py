@@ -1,5 +1,6 @@
 # Write all the blog posts in reverse chronological order
 from zeekofile.cache import zf
+from .paginator import Paginator
 
 blog = zf.config.controllers.blog
 
@@ -10,43 +11,39 @@ def run():
 
 
 def write_blog_chron(posts, root, name=None):
-    page_num = 1
-    post_num = 0
-
-    while len(posts) > post_num:
-        # Write the pages, num_per_page posts per page:
-        page_posts = posts[post_num : post_num + blog.posts_per_page]
-        post_num += blog.posts_per_page
-        if page_num > 1:
-            prev_link = "../" + str(page_num - 1)
-        else:
-            prev_link = None
-        if len(posts) > post_num:
-            next_link = "../" + str(page_num + 1)
-        else:
-            next_link = None
-        page_dir = zf.util.path_join(blog.path, root, str(page_num))
+    # Write the pages, num_per_page posts per page:
+    paginator = Paginator(
+        posts, blog.posts_per_page, lambda page_num: "../" + str(page_num)
+    )
+    for page in paginator:
+        page_dir = zf.util.path_join(blog.path, root, str(page.number))
         fn = zf.util.path_join(page_dir, "index.html")
         env = {
-            "posts": page_posts,
-            "next_link": next_link,
-            "prev_link": prev_link,
+            "posts": page,
+            "page": page,
+            "next_link": page.next_link,
+            "prev_link": page.prev_link,
             "name": name,
         }
         zf.writer.materialize_template("/blog/chronological.mako", fn, env)
-        page_num += 1
 
 
 def write_blog_first_page():
     if not blog.custom_index:
-        page_posts = blog.posts[: blog.posts_per_page]
+        paginator = Paginator(
+            blog.posts,
+            blog.posts_per_page,
+            lambda page_num: zf.util.site_path_helper(
+                blog.path, blog.pagination_dir + "/" + str(page_num)
+            ),
+        )
+        page = paginator.page(1)
         path = zf.util.path_join(blog.path, "index.html")
         blog.logger.info("Writing blog index page: " + path)
-        if len(blog.posts) > blog.posts_per_page:
-            next_link = zf.util.site_path_helper(
-                blog.path, blog.pagination_dir + "/2"
-            )
-        else:
-            next_link = None
-        env = {"posts": page_posts, "next_link": next_link, "prev_link": None}
+        env = {
+            "posts": page,
+            "page": page,
+            "next_link": page.next_link,
+            "prev_link": None,
+        }
         zf.writer.materialize_template("/blog/chronological.mako", path, env)
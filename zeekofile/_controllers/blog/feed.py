@@ -18,5 +18,24 @@ def write_feed(posts, root, template):
     root = root.lstrip("/")
     path = zf.util.path_join(root, "index.xml")
     blog.logger.info("Writing RSS/Atom feed: " + path)
+    if blog.feed_length is not None:
+        posts = posts[: blog.feed_length]
     env = {"posts": posts, "root": root}
-    zf.writer.materialize_template(template, path, env)
+    zf.writer.materialize_template(
+        template, path, env, cache_key=_cache_key(posts, root)
+    )
+
+
+def _cache_key(posts, root):
+    """Key a feed by its posts, in order, and the config.
+
+    A feed only changes when one of its posts does, so the feeds of
+    categories untouched by a change are reused from the output cache."""
+    return zf.manifest.digest(
+        root,
+        zf.writer.manifest.inputs["config"],
+        *[
+            "{0} {1} {2}".format(p.guid, p.updated, p.source_digest)
+            for p in posts
+        ],
+    )
@@ -0,0 +1,83 @@
+"""
+Pagination of post listings.
+
+A Paginator splits a sorted list of posts into pages of
+blog.posts_per_page.  Each Page is a view onto the list, so no page copies
+the posts it holds; templates get the page as ``page`` and can iterate it,
+index it and take its len() like a list.
+"""
+
+import collections.abc
+
+from zeekofile.cache import zf
+
+
+class Paginator(object):
+    """Pages over posts, with link(page_number) giving the URL of a page"""
+
+    def __init__(self, posts, per_page, link):
+        self.posts = posts
+        self.per_page = per_page
+        self.link = link
+        self.num_pages = (len(posts) + per_page - 1) // per_page
+
+    def __len__(self):
+        return self.num_pages
+
+    def __iter__(self):
+        for number in range(1, self.num_pages + 1):
+            yield self.page(number)
+
+    def page(self, number):
+        return Page(self, number)
+
+
+class Page(collections.abc.Sequence):
+    """One page of a Paginator: a view of posts[start:stop]"""
+
+    def __init__(self, paginator, number):
+        self.paginator = paginator
+        self.number = number
+        self.start = (number - 1) * paginator.per_page
+        self.stop = min(self.start + paginator.per_page, len(paginator.posts))
+
+    @property
+    def prev_link(self):
+        if self.number > 1:
+            return self.paginator.link(self.number - 1)
+        return None
+
+    @property
+    def next_link(self):
+        if self.number < self.paginator.num_pages:
+            return self.paginator.link(self.number + 1)
+        return None
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.paginator.posts[self.start + index]
+
+    def __iter__(self):
+        posts = self.paginator.posts
+        for i in range(self.start, self.stop):
+            yield posts[i]
+
+    def __repr__(self):
+        return "<Page {0} of {1}>".format(
+            self.number, self.paginator.num_pages
+        )
+
+    def fingerprint(self):
+        """Identify the page by its posts and links in the build
+        manifest"""
+        return zf.manifest.fingerprint(
+            [list(self), self.number, self.prev_link, self.next_link]
+        )
@@ -10,15 +10,19 @@ __date__ = "Mon Feb  2 21:21:04 2009"
 
 import datetime
 import hashlib
+import html.parser
 import logging
 import operator
 import os
+import pickle
 import re
 import sys
 import urllib.parse as urlparse
 
+from mako.filters import xml_escape
 import pytz
 import yaml
+from zeekofile.writer import NestedRenderError
 import zeekofile_zf as zf
 
 
@@ -54,12 +58,32 @@ reserved_field_names = {
     "draft": "If 'true' or 'True', the post is considered to be only a "
     "draft and not to be published.",
     "source": "Reserved internally",
+    "source_digest": "Reserved internally",
+    "meta_digest": "Reserved internally",
     "yaml": "Reserved internally",
     "content": "Reserved internally",
+    "excerpt": "A short plain text summary of the post. If not provided, "
+    "it is made from the first blog.post_excerpts.word_length words of the "
+    "post",
+    "feed_content": "Reserved internally",
     "filename": "Reserved internally",
 }
 
 
+# post path -> the Post parsed from it by the last parse_posts(), or None
+# if it wasn't published
+_parsed = {}
+
+# post path -> (mtime_ns, size, digest of the YAML, the parsed YAML) of the
+# post's front matter; see _load_header()
+_headers = {}
+
+_yaml_sep = re.compile("^---$", re.MULTILINE)
+
+# libyaml's loader, where it's available, is many times faster
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
 class PostParseException(Exception):
 
     def __init__(self, value):
@@ -74,8 +98,14 @@ class Post(object):
     Class to describe a blog post and associated metadata
     """
 
-    def __init__(self, source, filename="Untitled"):
+    def __init__(self, source, filename="Untitled", header=None):
+        # digest of the post's metadata, set once it's parsed; see
+        # __getattribute__()
+        self.meta_digest = None
         self.source = source
+        self.source_digest = hashlib.sha1(
+            (filename + "\0" + source).encode("utf-8")
+        ).hexdigest()
         self.yaml = None
         self.title = None
         self.__timezone = zf.config.controllers.blog.timezone
@@ -84,37 +114,155 @@ class Post(object):
         self.categories = set()
         self.tags = set()
         self.permalink = None
-        self.content = ""
+        # the filtered post body, made when content is first read
+        self._content = None
         self.filename = filename
         self.author = ""
         self.guid = None
         self.slug = None
         self.draft = False
         self.filters = None
-        self.__parse()
+        self._excerpt = None
+        # (product name, parameters...) -> (value, what computing it read);
+        # see _memoized()
+        self._products = {}
+        self.__parse(header)
         self.__post_process()
+        self.meta_digest = hashlib.sha1(
+            (filename + "\0" + self.yaml).encode("utf-8")
+        ).hexdigest()
+
+    def __getattribute__(self, name):
+        # the build manifest notes which outputs read the post's metadata
+        # (or anything else about it), as it does for its content
+        if not name.startswith("_"):
+            meta_digest = object.__getattribute__(self, "meta_digest")
+            if meta_digest is not None:
+                zf.manifest.record_source(meta_digest)
+        return object.__getattribute__(self, name)
 
     def __repr__(self):  # pragma: no cover
         return "<Post title='{0}' date='{1}'>".format(
             self.title, self.date.strftime("%Y/%m/%d %H:%M:%S")
         )
 
-    def __parse(self):
-        """Parse the yaml and fill fields"""
-        yaml_sep = re.compile("^---$", re.MULTILINE)
-        content_parts = yaml_sep.split(self.source, maxsplit=2)
-        if len(content_parts) < 2:
-            raise PostParseException(
-                "{0}: Post has no YAML section".format(self.filename)
-            )
+    @property
+    def content(self):
+        # the build manifest notes which outputs read the post's content
+        zf.manifest.record_source(self.source_digest)
+        if self._content is None:
+            self.load_content()
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    def load_content(self):
+        """Run the post's body through its filter chain, unless that's
+        been done already.
+
+        The post's metadata is all there once it's parsed; the body is
+        only filtered when content is first read, so a build that doesn't
+        need a post's HTML never pays for its filters."""
+        if self._content is None:
+            post_src = _split_front_matter(self.source, self.filename)[1]
+            self._content = zf.filter.run_chain(self.filters, post_src)
+
+    def _memoized(self, key, compute):
+        """Return compute(), computed once per build for each key.
+
+        What computing it read, such as the post's content, is recorded in
+        the build manifest for every output that uses the result."""
+        try:
+            value, captured = self._products[key]
+        except KeyError:
+            with zf.manifest.capturing() as captured:
+                value = compute()
+            self._products[key] = value, captured
         else:
-            # Extract the yaml at the top
-            self.__parse_yaml(content_parts[1])
-            post_src = content_parts[2]
-        self.__apply_filters(post_src)
+            zf.manifest.replay(captured)
+        return value
+
+    def reset_products(self):
+        """Forget the products of the last build"""
+        self._products.clear()
+
+    @property
+    def excerpt(self):
+        """The post's excerpt, as given in its YAML or else made from its
+        first blog.post_excerpts.word_length words"""
+        if self._excerpt is not None:
+            return self._excerpt
+        return self.get_excerpt()
+
+    @excerpt.setter
+    def excerpt(self, excerpt):
+        self._excerpt = excerpt
+
+    def get_excerpt(self, num_words=None):
+        """Return the first num_words words of the post's text, without
+        markup or headings.
+
+        The text is HTML escaped, as the HTML parser decodes character
+        references such as ``&lt;``; it's safe to put into a page as is."""
+        if num_words is None:
+            num_words = zf.config.controllers.blog.post_excerpts.word_length
+        return self._memoized(
+            ("excerpt", num_words),
+            lambda: _make_excerpt(self.content, num_words),
+        )
+
+    @property
+    def feed_content(self):
+        """The post's content, XML escaped for the body of a feed entry"""
+        return self._memoized(
+            ("feed_content",), lambda: xml_escape(self.content)
+        )
 
-    def __apply_filters(self, post_src):
-        """Apply filters to the post"""
+    def render(self, template_name, **kwargs):
+        """Render a template with the post as ``post``, along with kwargs.
+
+        The result is reused by every page that renders the same template
+        and arguments for this post, such as the permapage, listings and
+        feeds; template_name is looked up from the template directories,
+        like "/blog/post.mako"."""
+
+        def compute():
+            template = zf.writer.template_lookup.get_template(template_name)
+            attrs = dict(kwargs, post=self)
+            rendered = zf.writer.template_render(template, attrs)
+            if rendered is None:
+                # fail the page rendering this one too, rather than
+                # writing "None" into it; nor is the failure memoized
+                raise NestedRenderError(template_name)
+            return rendered
+
+        return self._memoized(
+            ("render", template_name, zf.writer.manifest.fingerprint(kwargs)),
+            compute,
+        )
+
+    def fingerprint(self):
+        """Identify this post in the build manifest.
+
+        The post's metadata and content are recorded for an output as
+        they're read, so only its identity goes into an output's key."""
+        return "post:" + self.filename
+
+    def __parse(self, header=None):
+        """Parse the yaml and fill fields.
+
+        header is the already parsed yaml, if the caller has it."""
+        self.yaml = _split_front_matter(self.source, self.filename)[0]
+        if header is None:
+            header = yaml.load(self.yaml, Loader=_YamlLoader)
+        self.__parse_yaml(header)
+        self.__resolve_filters()
+
+    def __resolve_filters(self):
+        """Work out the filter chain for the post; it's run by
+        load_content()"""
         # Apply block level filters (filters on only part of the post)
         # TODO: block level filters on posts
         # Apply post level filters (filters on the entire post)
@@ -128,7 +276,6 @@ class Post(object):
                 ]
             except KeyError:
                 self.filters = []
-        self.content = zf.filter.run_chain(self.filters, post_src)
 
     def __post_process(self):
         # fill in empty default value
@@ -201,8 +348,7 @@ class Post(object):
 
         logger.debug("Permalink: {0}".format(self.permalink))
 
-    def __parse_yaml(self, yaml_src):
-        y = yaml.safe_load(yaml_src)
+    def __parse_yaml(self, y):
         # Load all the fields that require special processing first:
         fields_need_processing = (
             "permalink",
@@ -252,7 +398,7 @@ class Post(object):
         except:
             pass
         try:
-            self.tags = set([x.strip() for x in y["tags"].split(",")])
+            self.tags = set([Tag(x.strip()) for x in y["tags"].split(",")])
         except:
             pass
         try:
@@ -302,8 +448,82 @@ class Post(object):
             raise AttributeError(name)
 
 
+class _TextExtractor(html.parser.HTMLParser):
+    """Collect the text of an HTML fragment, other than headings and
+    scripts"""
+
+    skip_tags = {
+        "script",
+        "noscript",
+        "style",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+    }
+
+    def __init__(self):
+        html.parser.HTMLParser.__init__(self)
+        self.text = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self.skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags and self.skipping:
+            self.skipping -= 1
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.text.append(data)
+
+
+def _split_front_matter(source, filename):
+    """Return the YAML front matter and the body of a post's source"""
+    content_parts = _yaml_sep.split(source, maxsplit=2)
+    if len(content_parts) < 3:
+        raise PostParseException(
+            "{0}: Post has no YAML section".format(filename)
+        )
+    return content_parts[1], content_parts[2]
+
+
+def _load_header(post_path, st, yaml_src):
+    """Return the parsed YAML front matter of the post at post_path.
+
+    The last parse is reused while the file's mtime and size are
+    unchanged, or while its YAML is, as when only the body was edited."""
+    cached = _headers.get(post_path)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[3]
+    digest = hashlib.sha1(yaml_src.encode("utf-8")).hexdigest()
+    if cached is not None and cached[2] == digest:
+        header = cached[3]
+    else:
+        header = yaml.load(yaml_src, Loader=_YamlLoader)
+    _headers[post_path] = (st.st_mtime_ns, st.st_size, digest, header)
+    return header
+
+
+def _make_excerpt(content, num_words):
+    extractor = _TextExtractor()
+    extractor.feed(content)
+    extractor.close()
+    words = "".join(extractor.text).split()
+    if len(words) <= num_words:
+        return xml_escape(" ".join(words))
+    return xml_escape(" ".join(words[:num_words])) + "..."
+
+
 class Category(object):
 
+    # the blog setting naming the directory of the listing pages
+    dir_setting = "category_dir"
+
     def __init__(self, name):
         self.name = name
         # TODO: slugification should be abstracted out somewhere reusable
@@ -311,7 +531,7 @@ class Category(object):
         self.url_name = self.name.lower().replace(" ", "-")
         self.path = zf.util.site_path_helper(
             zf.config.controllers.blog.path,
-            zf.config.controllers.blog.category_dir,
+            getattr(zf.config.controllers.blog, self.dir_setting),
             self.url_name,
         )
 
@@ -339,6 +559,13 @@ class Category(object):
         return self.name >= other.name
 
 
+class Tag(Category):
+    """A post's tag; like a Category, it has the url_name and path of its
+    listing pages"""
+
+    dir_setting = "tag_dir"
+
+
 def parse_posts(directory):
     """Retrieve all the posts from the directory specified.
 
@@ -355,6 +582,7 @@ def parse_posts(directory):
         for f in zf.util.recursive_file_list(directory, post_filename_re)
         if post_filename_re.match(f)
     ]
+    to_parse = []
 
     for post_path in post_paths:
         post_fn = os.path.split(post_path)[1]
@@ -365,21 +593,116 @@ def parse_posts(directory):
                 "Skipping post %s - BLOGOFILE_PUBLISH_DRAFTS not set", post_fn
             )
             continue
+        to_parse.append(post_path)
+
+    # When the writer knows which sources changed since the last build,
+    # posts whose files didn't change are reused from the last parse
+    changed = zf.writer.changed_paths
+    if changed is None:
+        _parsed.clear()
+    needed = [
+        post_path
+        for post_path in to_parse
+        if changed is None
+        or post_path not in _parsed
+        or os.path.normpath(post_path) in changed
+    ]
 
-        logger.debug("Parsing post: {0}".format(post_path))
-        try:
-            with open(post_path, "r") as _file:
-                src = _file.read()
-        except:
-            logger.exception("Error reading post: {0}".format(post_path))
-            raise
-        try:
-            p = Post(src, filename=post_fn)
-        except PostParseException as e:
-            logger.warning("{0} : Skipping this post.".format(e.value))
-            continue
-        # Exclude some posts
-        if not (p.permalink is None or p.draft is True):
+    if zf.parallel.jobs() > 1:
+        records = zf.parallel.map_jobs(_read_post_in_worker, needed)
+    else:
+        records = [None] * len(needed)
+    for post_path, record in zip(needed, records):
+        if record is None:
+            # not run on the pool, or couldn't be; parse it here
+            p = _parsed[post_path] = _read_post(post_path)
+            if p is not None and zf.parallel.jobs() > 1:
+                # templates rendered on the pool can't run filters that
+                # aren't process safe, so filter the post here
+                p.load_content()
+        else:
+            _parsed[post_path] = pickle.loads(record)
+
+    for post_path in set(_parsed).difference(to_parse):
+        del _parsed[post_path]
+    for post_path in set(_headers).difference(to_parse):
+        del _headers[post_path]
+    # str(chain) -> chain, for each filter chain the posts use
+    chains = {}
+    for post_path in to_parse:
+        p = _parsed[post_path]
+        if p is not None:
+            p.reset_products()
             posts.append(p)
+            chains[str(p.filters)] = p.filters
+    # posts are only filtered as their content is read, which may not
+    # happen in this build; have the filters do their side effects, such
+    # as writing stylesheets, as they would for a filter cache hit
+    for chain in chains.values():
+        zf.filter.skip_chain(chain)
     posts.sort(key=operator.attrgetter("date"), reverse=True)
     return posts
+
+
+def _read_post(post_path):
+    """Read and parse a single post.
+
+    Returns None if the post is not to be published."""
+    post_fn = os.path.split(post_path)[1]
+    logger.debug("Parsing post: {0}".format(post_path))
+    try:
+        with open(post_path, "r") as _file:
+            src = _file.read()
+            st = os.fstat(_file.fileno())
+    except:
+        logger.exception("Error reading post: {0}".format(post_path))
+        raise
+    try:
+        yaml_src = _split_front_matter(src, post_fn)[0]
+        header = _load_header(post_path, st, yaml_src)
+        # Exclude some posts before running their filters
+        if isinstance(header, dict):
+            if header.get("draft"):
+                logger.info(
+                    "Post {0} is set to draft, "
+                    "ignoring this post".format(post_fn)
+                )
+                return None
+            if (
+                "permalink" not in header
+                and not zf.config.controllers.blog.auto_permalink.enabled
+            ):
+                return None
+        p = Post(src, filename=post_fn, header=header)
+    except PostParseException as e:
+        logger.warning("{0} : Skipping this post.".format(e.value))
+        return None
+    # Exclude some posts
+    if p.permalink is None or p.draft is True:
+        return None
+    return p
+
+
+def _read_post_in_worker(post_path):
+    """Parse and filter a post on the process pool, returning it pickled.
+
+    With more than one job the posts are filtered as they're parsed, so
+    that filtering runs in parallel, rather than in every worker that
+    renders a page reading a post's content.
+
+    Returns None if the post needs to be parsed in the build process
+    instead: it uses a filter that isn't process safe, it can't be pickled,
+    or parsing failed (so that the error is raised from the build process).
+    """
+    try:
+        p = _read_post(post_path)
+        if p is not None:
+            p.load_content()
+        return pickle.dumps(p)
+    except zf.parallel.ProcessUnsafe as e:
+        logger.debug(
+            "Filter %s is not process safe, parsing %s serially", e, post_path
+        )
+    except Exception:
+        logger.debug("Parsing %s on the process pool failed", post_path)
+    return None
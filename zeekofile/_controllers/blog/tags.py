@@ -0,0 +1,53 @@
+from zeekofile.cache import zf
+from . import feed
+from .paginator import Paginator
+
+blog = zf.config.controllers.blog
+
+
+def run():
+    if blog.tags.enabled:
+        write_tags()
+
+
+def write_tags():
+    """Write the listing pages and feeds of each tag, from the index built
+    by categories.sort_into_categories()"""
+    root = zf.util.path_join(blog.path, blog.tag_dir)
+    for tag, tag_posts in blog.tagged_posts.items():
+        url_name = tag.url_name
+        rss_path = zf.util.fs_site_path_helper(
+            blog.path, blog.tag_dir, url_name, "feed"
+        )
+        feed.write_feed(tag_posts, rss_path, "/blog/rss.mako")
+        atom_path = zf.util.fs_site_path_helper(
+            blog.path, blog.tag_dir, url_name, "feed", "atom"
+        )
+        feed.write_feed(tag_posts, atom_path, "/blog/atom.mako")
+        paginator = Paginator(
+            tag_posts,
+            blog.posts_per_page,
+            lambda page_num, url_name=url_name: zf.util.site_path_helper(
+                blog.path, blog.tag_dir, url_name, str(page_num)
+            ),
+        )
+        for page in paginator:
+            path = zf.util.path_join(
+                root, url_name, str(page.number), "index.html"
+            )
+            env = {
+                "tag": tag,
+                "posts": page,
+                "page": page,
+                "prev_link": page.prev_link,
+                "next_link": page.next_link,
+            }
+            zf.writer.materialize_template(
+                "/blog/chronological.mako", path, env
+            )
+
+            # Copy tag/1 to tag/index.html
+            if page.number == 1:
+                zf.writer.copy_output(
+                    path, zf.util.path_join(root, url_name, "index.html")
+                )
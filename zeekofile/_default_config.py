@@ -52,14 +52,74 @@ blog.post_excerpts.word_length = 25
 # secondary directory for pagination
 blog.pagination_dir = "page"
 
+# the number of newest posts in each feed; None for every post
+blog.feed_length = None
+
 # secondary directory for categories
 blog.category_dir = "category"
 
+# write a listing and feeds for each tag, under blog.tag_dir
+blog.tags.enabled = False
+blog.tag_dir = "tag"
+
 blog.post_encoding = "utf-8"
 
 # use hard links when copying files
 site.use_hard_links = False
 
+# how static files are copied into _site: "auto" to use the fastest method
+# the filesystems support, or one of "hardlink", "reflink",
+# "copy_file_range", "sendfile" or "copy".  "auto" only hard links files
+# when site.use_hard_links is set
+site.copy_method = "auto"
+
+# directory for data kept between builds, such as the build manifest and
+# compiled templates; it's kept out of _site, so that it's not deployed with
+# the site, and is never copied into the site wherever it is
+site.cache_dir = ".zeekofile-cache"
+
+# number of worker processes used to parse posts and render pages (--jobs)
+site.jobs = 1
+
+# size limit in bytes of the cache of filter chain output; least recently
+# used entries are evicted past this
+site.filter_cache_size = 100 * 1024 * 1024
+
+# size limit in bytes of the cache of rendered outputs, such as feeds, that
+# can be reused across builds
+site.output_cache_size = 100 * 1024 * 1024
+
+# size limit in bytes of the cache of code blocks highlighted by the
+# syntax_highlight filter, shared across posts and builds
+site.highlight_cache_size = 20 * 1024 * 1024
+
+# how --serve watches for changes: "inotify", "poll", or "auto" to use
+# inotify where it's available
+site.watcher = "auto"
+# seconds to wait for a burst of changes to end before rebuilding
+site.watch_debounce = 0.2
+# have pages served by --serve reload themselves (and swap in changed
+# stylesheets) when a rebuild changes them
+site.live_reload = True
+
+# only re-render outputs whose templates, posts or config have changed
+# since the last build (--full turns this off)
+site.incremental = True
+
+# what happens when a template fails to render: "continue" reports the
+# error and carries on without that output, "collect" carries on and fails
+# the build at the end with a summary of every failure (--strict), and
+# "stop" fails the build at the first (--fail-fast)
+site.render_errors = "continue"
+
+# how a build gets into _site: "staged" renders into a directory on the
+# same filesystem and then moves each changed file into place, "direct"
+# renders straight into _site.  Either way, files whose contents haven't
+# changed are left untouched.  With "direct", files written into _site by
+# third party controllers or filters other than through zf.writer are
+# deleted at the end of the build, unless --no-delete is given.
+site.write_mode = "staged"
+
 
 # files to ignore when building
 site.file_ignore_patterns = [
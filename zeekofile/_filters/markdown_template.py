@@ -1,6 +1,7 @@
 import logging
 
 import markdown
+import zeekofile_zf as zf
 
 # Markdown logging is noisy, pot it down:
 logging.getLogger("MARKDOWN").setLevel(logging.ERROR)
@@ -9,8 +10,35 @@ config = {
     "name": "Markdown",
     "description": "Renders markdown formatted text to HTML",
     "aliases": ["markdown"],
+    # passed on to markdown.Markdown(), e.g.
+    # filters.markdown.extensions = ["tables", "fenced_code"]
+    "extensions": [],
+    "extension_configs": {},
 }
 
+# fingerprint of the extensions and their configs -> Markdown converter,
+# reset and reused for every post
+_converters = {}
+
+
+def _converter():
+    settings = zf.config.filters.markdown
+    key = zf.manifest.fingerprint(
+        [settings.extensions, settings.extension_configs]
+    )
+    try:
+        return _converters[key]
+    except KeyError:
+        md = _converters[key] = markdown.Markdown(
+            extensions=list(settings.extensions),
+            extension_configs=dict(settings.extension_configs),
+        )
+        return md
+
+
+def cache_version():
+    return markdown.__version__
+
 
 def run(content):
-    return markdown.markdown(content)
+    return _converter().reset().convert(content)
@@ -1,4 +1,6 @@
+import docutils
 import docutils.core
+import docutils.io
 
 config = {
     "name": "reStructuredText",
@@ -6,13 +8,40 @@ config = {
     "aliases": ["rst", "rst_filter"],
 }
 
+# initial_header_level -> Publisher, with its settings, reader, parser and
+# writer set up once and reused for every post
+_publishers = {}
+
+
+def _publisher(initial_header_level):
+    try:
+        return _publishers[initial_header_level]
+    except KeyError:
+        pass
+    publisher = docutils.core.Publisher(
+        "standalone",
+        "restructuredtext",
+        "html",
+        source_class=docutils.io.StringInput,
+        destination_class=docutils.io.StringOutput,
+    )
+    publisher.process_programmatic_settings(
+        None, dict(initial_header_level=initial_header_level), None
+    )
+    _publishers[initial_header_level] = publisher
+    return publisher
+
+
+def cache_version():
+    return docutils.__version__
+
 
 def run(content, initial_header_level=1):
-    return docutils.core.publish_parts(
-        content,
-        writer_name="html",
-        settings_overrides=dict(initial_header_level=initial_header_level),
-    )["html_body"]
+    publisher = _publisher(initial_header_level)
+    publisher.set_source(content, None)
+    publisher.set_destination(None, None)
+    publisher.publish()
+    return publisher.writer.parts["html_body"]
 
 
 def opts(initial_header_level=1):
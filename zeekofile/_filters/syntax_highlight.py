@@ -2,6 +2,7 @@ import os
 import re
 
 from mako.filters import html_entities_unescape
+import pygments
 from pygments import formatters
 from pygments import highlight
 from pygments import lexers
@@ -10,6 +11,15 @@ import zeekofile_zf as zf
 
 css_files_written = set()
 
+# language -> lexer, and style -> formatter; both are reused for every block
+_lexers = {}
+_formatters = {}
+# id() of each formatter in _formatters -> its style
+_formatter_styles = {}
+
+# highlighted blocks, by code, language and style; set up by init()
+block_cache = None
+
 config = {
     "name": "highlight",
     "description": "run pygments on some code",
@@ -25,13 +35,47 @@ code_block_re = re.compile(
 )
 
 
-def highlight_code(code, language, formatter):
+def _lexer(language):
+    try:
+        return _lexers[language]
+    except KeyError:
+        pass
     try:
         lexer = lexers.get_lexer_by_name(language)
     except util.ClassNotFound:
         lexer = lexers.get_lexer_by_name("text")
-    highlighted = "\n\n" + highlight(code, lexer, formatter) + "\n\n"
-    return highlighted
+    _lexers[language] = lexer
+    return lexer
+
+
+def _formatter(style=None):
+    if style is None:
+        style = zf.config.filters.syntax_highlight.style
+    try:
+        return _formatters[style]
+    except KeyError:
+        formatter = _formatters[style] = formatters.HtmlFormatter(
+            linenos=False, cssclass="pygments_" + style, style=style
+        )
+        _formatter_styles[id(formatter)] = style
+        return formatter
+
+
+def highlight_code(code, language, formatter):
+    # only blocks highlighted with our own formatters are cached, as
+    # they're known by their style alone
+    style = _formatter_styles.get(id(formatter))
+    if block_cache is not None and style is not None:
+        key = zf.manifest.digest(
+            pygments.__version__, style, str(language), code
+        )
+        highlighted = block_cache.get(key)
+        if highlighted is None:
+            highlighted = highlight(code, _lexer(language), formatter)
+            block_cache.set(key, highlighted)
+    else:
+        highlighted = highlight(code, _lexer(language), formatter)
+    return "\n\n" + highlighted + "\n\n"
 
 
 def write_pygments_css(style, formatter, location="/css"):
@@ -42,18 +86,38 @@ def write_pygments_css(style, formatter, location="/css"):
     css_path = os.path.join(path, "pygments_" + style + ".css")
     if css_path in css_files_written:
         return  # already written, no need to overwrite it.
-    f = open(css_path, "w")
-    f.write(formatter.get_style_defs(".pygments_" + style))
-    f.close()
+    zf.writer.write_output(
+        css_path, formatter.get_style_defs(".pygments_" + style)
+    )
     css_files_written.add(css_path)
 
 
+def init():
+    global block_cache
+    # each build writes to a fresh output dir
+    css_files_written.clear()
+    # the blocks of an edited post that are unchanged come from the cache,
+    # as do blocks repeated across posts
+    block_cache = zf.diskcache.DiskCache(
+        "highlight",
+        zf.util.path_join(zf.config.site.cache_dir, "highlight"),
+        zf.config.site.highlight_cache_size,
+    )
+
+
+def cache_version():
+    return pygments.__version__
+
+
+def cache_hit():
+    # the highlighted output came from the filter cache; the stylesheet
+    # still needs to be written for this build
+    write_pygments_css(zf.config.filters.syntax_highlight.style, _formatter())
+
+
 def highlight_site(code, lang="python"):
     style = zf.config.filters.syntax_highlight.style
-    css_class = "pygments_" + style
-    formatter = formatters.HtmlFormatter(
-        linenos=False, cssclass=css_class, style=style
-    )
+    formatter = _formatter(style)
     write_pygments_css(style, formatter)
     return highlight_code(code, lang, formatter)
 
@@ -61,10 +125,7 @@ def highlight_site(code, lang="python"):
 def run(src):
 
     style = zf.config.filters.syntax_highlight.style
-    css_class = "pygments_" + style
-    formatter = formatters.HtmlFormatter(
-        linenos=False, cssclass=css_class, style=style
-    )
+    formatter = _formatter(style)
     write_pygments_css(style, formatter)
 
     def repl(m):
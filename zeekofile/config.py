@@ -12,12 +12,14 @@ import urllib.parse
 from . import cache
 from . import controller
 from . import filter
+from . import manifest
 from .cache import zf
 
 
 zf.config = sys.modules["zeekofile.config"]
 
 __loaded = False
+_config_file = None
 
 
 class UnknownConfigSectionException(Exception):
@@ -30,6 +32,14 @@ class ConfigNotFoundException(Exception):
 
 override_options = {}
 
+# options that change how the site is built, but not what is built
+build_options = (
+    "site.incremental",
+    "site.jobs",
+    "site.render_errors",
+    "site.live_reload",
+)
+
 site = cache.HierarchicalCache()
 controllers = cache.HierarchicalCache()
 filters = cache.HierarchicalCache()
@@ -97,6 +107,8 @@ def __load_config(path=None):
 def init(config_file_path=None):
     # Initialize the config, if config_file_path is None,
     # just load the default config
+    global _config_file
+    _config_file = config_file_path
     if config_file_path:
         if not os.path.isfile(config_file_path):
             raise ConfigNotFoundException
@@ -104,3 +116,27 @@ def init(config_file_path=None):
     else:
         __load_config()
     return globals()["__name__"]
+
+
+def digest():
+    """Digest the loaded configuration along with the zeekofile, filter and
+    controller code, for the build manifest"""
+    config_files = [default_path]
+    if _config_file:
+        config_files.append(_config_file)
+    modules = [sys.modules["zeekofile"]]
+    for section in (filters, controllers):
+        for c in section.values():
+            if isinstance(c, cache.HierarchicalCache) and "mod" in c:
+                modules.append(c.mod)
+    return manifest.digest(
+        *[str(manifest.file_digest(p)) for p in config_files],
+        repr(
+            sorted(
+                (k, v)
+                for k, v in override_options.items()
+                if k not in build_options
+            )
+        ),
+        manifest.code_digest(modules),
+    )
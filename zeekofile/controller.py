@@ -49,6 +49,8 @@ import logging
 import operator
 import os
 
+from . import manifest
+from . import profiler
 from . import util
 from .cache import zf
 
@@ -97,7 +99,7 @@ def init_controllers():
 def load_controller(name, directory="_controllers"):
     """Load a single controller by name"""
 
-    return util.load_py_module(
+    mod = util.load_py_module(
         name,
         directory,
         __loaded_controllers,
@@ -105,6 +107,9 @@ def load_controller(name, directory="_controllers"):
         default_controller_config,
         "controllers",
     )
+    # key builds on the code as loaded; see manifest.module_digest()
+    manifest.module_digest(mod)
+    return mod
 
 
 def load_controllers(directory="_controllers"):
@@ -163,7 +168,8 @@ def run_all():
         controller = zf.config.controllers[name].mod
         if "run" in dir(controller):
             logger.info("running controller: {0}".format(name))
-            controller.run()
+            with profiler.timed("controller", name):
+                controller.run()
         else:
             logger.debug(
                 "controller {0} has no run() method, skipping it.".format(name)
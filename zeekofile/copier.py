@@ -0,0 +1,172 @@
+"""
+copier.py copies static files into the site.
+
+A file can be hard linked, cloned with a copy-on-write reflink (FICLONE),
+copied in the kernel with copy_file_range() or sendfile(), or copied
+through Python.  Which of these works depends on the filesystems involved,
+so each is tried in turn, and a method that fails is not tried again for
+the same pair of filesystems.  Copies keep the source's mtime, so that a
+later build can tell an unchanged copy by its size and mtime alone.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import sys
+
+from . import profiler
+from .cache import zf
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+zf.copier = sys.modules["zeekofile.copier"]
+
+logger = logging.getLogger("zeekofile.copier")
+
+METHODS = ("hardlink", "reflink", "copy_file_range", "sendfile", "copy")
+
+# from linux/fs.h
+_FICLONE = 0x40049409
+
+# errors meaning a method isn't supported here, rather than the copy failing
+_UNSUPPORTED = set(
+    getattr(errno, name)
+    for name in (
+        "EXDEV",
+        "EPERM",
+        "EMLINK",
+        "EINVAL",
+        "ENOSYS",
+        "ENOTTY",
+        "EBADF",
+        "EOPNOTSUPP",
+        "ENOTSUP",
+    )
+    if hasattr(errno, name)
+)
+
+# (source device, destination device) -> methods not yet seen to fail
+_working = {}
+
+
+def _methods():
+    method = zf.config.site.copy_method
+    if method != "auto":
+        if method not in METHODS:
+            raise ValueError(
+                "Unknown site.copy_method %r; expected 'auto' or one of %s"
+                % (method, ", ".join(METHODS))
+            )
+        return [method, "copy"] if method != "copy" else ["copy"]
+    methods = list(METHODS)
+    if not zf.config.site.use_hard_links:
+        # a hard linked file in _site is the source file, so only link
+        # when asked to
+        methods.remove("hardlink")
+    if fcntl is None:
+        methods.remove("reflink")
+    if not hasattr(os, "copy_file_range"):
+        methods.remove("copy_file_range")
+    if not hasattr(os, "sendfile"):
+        methods.remove("sendfile")
+    return methods
+
+
+def is_current(src, dest):
+    """Return True if dest is a copy of src that's still up to date, judged
+    by size and mtime"""
+    try:
+        st, dest_st = os.stat(src), os.stat(dest)
+    except OSError:
+        return False
+    return os.path.samestat(st, dest_st) or (
+        st.st_size == dest_st.st_size and st.st_mtime_ns == dest_st.st_mtime_ns
+    )
+
+
+def copy_file(src, dest):
+    """Copy src to dest with the first method that works.
+
+    dest is replaced rather than overwritten, so a hard link made by an
+    earlier build never leads back to writing into a source file."""
+    st = os.stat(src)
+    dest_dir = os.path.dirname(dest) or "."
+    devices = (st.st_dev, os.stat(dest_dir).st_dev)
+    methods = _working.get(devices)
+    if methods is None:
+        methods = _working[devices] = _methods()
+    tmp = dest + ".zeekofile-tmp"
+    for method in list(methods):
+        try:
+            _copy_methods[method](src, tmp, st)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED or method == "copy":
+                raise
+            logger.debug(
+                "Can't %s %s to %s (%s), falling back", method, src, dest, e
+            )
+            methods.remove(method)
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            continue
+        os.replace(tmp, dest)
+        profiler.add_bytes(st.st_size)
+        return method
+
+
+def _hardlink(src, dest, st):
+    if os.path.lexists(dest):
+        os.remove(dest)
+    os.link(src, dest)
+
+
+def _copy_with(copy):
+    """Make a method that opens both files and runs copy(fsrc, fdest, size)
+    before copying over the mtime"""
+
+    def copy_method(src, dest, st):
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+            copy(fsrc, fdest, st.st_size)
+        os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    return copy_method
+
+
+def _reflink(fsrc, fdest, size):
+    fcntl.ioctl(fdest.fileno(), _FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(fsrc, fdest, size):
+    while size > 0:
+        sent = os.copy_file_range(fsrc.fileno(), fdest.fileno(), size)
+        if sent == 0:
+            break
+        size -= sent
+
+
+def _sendfile(fsrc, fdest, size):
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(
+            fdest.fileno(), fsrc.fileno(), offset, size - offset
+        )
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _copy(fsrc, fdest, size):
+    shutil.copyfileobj(fsrc, fdest, 1024 * 1024)
+
+
+_copy_methods = {
+    "hardlink": _hardlink,
+    "reflink": _copy_with(_reflink),
+    "copy_file_range": _copy_with(_copy_file_range),
+    "sendfile": _copy_with(_sendfile),
+    "copy": _copy_with(_copy),
+}
@@ -0,0 +1,136 @@
+"""
+diskcache.py provides a size-limited, content-addressed cache of text and
+files kept on disk between builds.
+
+Entries are files named by the digest of whatever produced them; the mtime
+of an entry is bumped each time it is read, so that pruning the cache down
+to its size limit evicts the least recently used entries first.
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from . import util
+from .cache import zf
+
+zf.diskcache = sys.modules["zeekofile.diskcache"]
+
+logger = logging.getLogger("zeekofile.diskcache")
+
+# name -> the DiskCache of that name most recently created in this process
+caches = {}
+
+
+class DiskCache(object):
+
+    def __init__(self, name, directory, max_size):
+        self.name = name
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        caches[name] = self
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return the text stored under key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        util.mkdir(os.path.dirname(path))
+        # write to a temporary file first so that a concurrent reader, such
+        # as another --jobs worker, never sees a partial entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp, path)
+
+    def get_file(self, key):
+        """Return (text, path) for an entry stored with set_file(), where
+        path is the file stored along with the text, or None"""
+        path = self._path(key) + ".file"
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        value = self.get(key)
+        if value is None:
+            return None
+        return value, path
+
+    def set_file(self, key, value, src):
+        """Store text under key along with the file at src, hard linking
+        the file into the cache if possible"""
+        path = self._path(key) + ".file"
+        util.mkdir(os.path.dirname(path))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, path)
+        self.set(key, value)
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits within
+        max_size bytes"""
+        entries = []
+        total = 0
+        for path in util.recursive_file_list(self.directory):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            logger.debug("Evicting %s from the %s cache", path, self.name)
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def take_stats():
+    """Return {name: (hits, misses)} for this process's caches and reset
+    the counts"""
+    stats = {}
+    for name, c in caches.items():
+        stats[name] = (c.hits, c.misses)
+        c.hits = c.misses = 0
+    return stats
+
+
+def add_stats(stats):
+    """Add counts returned by take_stats() in a worker process"""
+    for name, (hits, misses) in stats.items():
+        if name in caches:
+            caches[name].hits += hits
+            caches[name].misses += misses
@@ -2,6 +2,10 @@ import logging
 import os
 import sys
 
+from . import diskcache
+from . import manifest
+from . import parallel
+from . import profiler
 from . import util
 from .cache import zf
 
@@ -11,31 +15,117 @@ zf.filter = sys.modules["zeekofile.filter"]
 
 __loaded_filters = {}
 
+# the filter chain output cache, set up by init_filters()
+chain_cache = None
+# resolved chain -> digest of its filters' code and config
+__chain_digests = {}
+
 default_filter_config = {
     "name": None,
     "description": None,
     "author": None,
     "url": None,
+    # False for filters that rely on running in the build process itself;
+    # posts using them are not parsed on the --jobs process pool
+    "process_safe": True,
+    # False for filters whose output isn't determined by their input, code
+    # and config alone; chains using them are never cached
+    "cacheable": True,
 }
 
 
 def run_chain(chain, content):
     """Run content through a filter chain.
 
-    Works with either a string or a sequence of filters"""
+    Works with either a string or a sequence of filters.
+
+    The output is cached on disk, keyed by the content, the chain and the
+    code and config of its filters, so an unchanged post skips its filters
+    entirely on the next build.  Filters may define a cache_hit() function,
+    called in place of run() when the output comes from the cache, for any
+    side effects run() would have had, and a cache_version() function
+    returning a string that's part of the key, such as the version of the
+    library doing the work, so that upgrading it invalidates the cache."""
     if chain is None:
         return content
 
     if isinstance(chain, str):
         chain = parse_chain(chain)
-    for fn in chain:
-        f = load_filter(fn)
+    filters = [load_filter(fn) for fn in chain]
+    if parallel.in_worker:
+        for fn in chain:
+            if not zf.config.filters[fn].process_safe:
+                raise parallel.ProcessUnsafe(fn)
+
+    key = _cache_key(chain, content)
+    if key is not None:
+        cached = chain_cache.get(key)
+        if cached is not None:
+            logger.debug("Filter cache hit: " + ", ".join(chain))
+            _cache_hit(filters)
+            return cached
+
+    for fn, f in zip(chain, filters):
         logger.debug("Applying filter: " + fn)
-        content = f.run(content)
+        with profiler.timed("filter", fn):
+            content = f.run(content)
     logger.debug("Content: " + content)
+    if key is not None:
+        chain_cache.set(key, content)
     return content
 
 
+def skip_chain(chain):
+    """Call the cache_hit() functions of a chain's filters, for content
+    that the chain may not be run on in this build"""
+    if chain is None:
+        return
+    if isinstance(chain, str):
+        chain = parse_chain(chain)
+    _cache_hit([load_filter(fn) for fn in chain])
+
+
+def _cache_hit(filters):
+    for f in filters:
+        if hasattr(f, "cache_hit"):
+            f.cache_hit()
+
+
+def _cache_key(chain, content):
+    """Return the chain cache key for content, or None if the chain isn't
+    cached"""
+    if chain_cache is None:
+        return None
+    chain = tuple(chain)
+    try:
+        chain_digest = __chain_digests[chain]
+    except KeyError:
+        chain_digest = __chain_digests[chain] = _chain_digest(chain)
+    if chain_digest is None:
+        return None
+    return manifest.digest(chain_digest, content)
+
+
+def _chain_digest(chain):
+    parts = []
+    for fn in chain:
+        filter_config = zf.config.filters[fn]
+        if not filter_config.cacheable:
+            return None
+        settings = dict(
+            (k, v)
+            for k, v in filter_config.items()
+            if k not in ("mod", "logger")
+        )
+        parts.append(fn)
+        parts.append(manifest.code_digest([filter_config.mod]))
+        parts.append(manifest.fingerprint(settings))
+        cache_version = getattr(filter_config.mod, "cache_version", None)
+        if cache_version is not None:
+            parts.append(str(cache_version()))
+    return manifest.digest(*parts)
+
+
 def parse_chain(chain):
     """Parse a filter chain into a sequence of filters"""
     parts = []
@@ -66,6 +156,13 @@ def preload_filters(directory="_filters"):
 def init_filters():
     """Filters have an optional init method that runs before the site is
     built"""
+    global chain_cache
+    chain_cache = diskcache.DiskCache(
+        "filters",
+        util.path_join(zf.config.site.cache_dir, "filters"),
+        zf.config.site.filter_cache_size,
+    )
+    __chain_digests.clear()
     for filt in zf.config.filters.values():
         if "mod" in filt:
             try:
@@ -85,6 +182,7 @@ def load_filter(name, directory="_filters"):
         default_filter_config,
         "filters",
     )
+    manifest.module_digest(mod)
     for alias_ in mod.config["aliases"]:
         setattr(zf.filters, alias_, mod.run)
     return mod
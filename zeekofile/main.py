@@ -1,15 +1,19 @@
 import argparse
 import logging
 import os
+import shutil
 import sys
-import time
 import traceback
 
 from . import config
+from . import filter
+from . import profiler
 from . import server
 from . import util
-from .writer import _check_output
+from . import watcher
+from .writer import _code_changes
 from .writer import _rebuild
+from .writer import RenderError
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +46,67 @@ def get_args():
             "specific files)"
         ),
     )
+    parser.add_argument(
+        "--full",
+        dest="full",
+        default=False,
+        action="store_true",
+        help="Re-render every output, ignoring the build manifest",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        dest="clear_cache",
+        default=False,
+        action="store_true",
+        help="Clear the build cache (filter output, build manifest) first",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Number of worker processes to use (default is site.jobs)",
+    )
+    parser.add_argument(
+        "--strict",
+        dest="render_errors",
+        action="store_const",
+        const="collect",
+        help="Fail the build, after rendering everything else, if any "
+        "template fails to render",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        dest="render_errors",
+        action="store_const",
+        const="stop",
+        help="Fail the build at the first template that fails to render",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        default=False,
+        action="store_true",
+        help="Time each phase, controller, filter and template of the build",
+    )
+    parser.add_argument(
+        "--profile-output",
+        dest="profile_output",
+        default=None,
+        metavar="FILE",
+        help="Where --profile writes its JSON report "
+        "(default is profile.json in site.cache_dir)",
+    )
+    parser.add_argument(
+        "--profile-top",
+        dest="profile_top",
+        type=int,
+        default=15,
+        metavar="N",
+        help="Number of slowest items --profile prints (default 15)",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -93,8 +158,20 @@ def main(argv=None, **kwargs):
 
     sys.path.insert(0, os.curdir)
 
+    # set as overrides, so that they survive the config being reloaded
+    if args.full:
+        config.override_options["site.incremental"] = False
+    if args.jobs is not None:
+        config.override_options["site.jobs"] = args.jobs
+    if args.render_errors is not None:
+        config.override_options["site.render_errors"] = args.render_errors
+
     config_init(args)
 
+    if args.clear_cache:
+        print("Clearing the build cache")
+        shutil.rmtree(config.site.cache_dir, ignore_errors=True)
+
     output_dir = util.path_join("_site", util.fs_site_path_helper())
 
     if args.serve:
@@ -102,20 +179,106 @@ def main(argv=None, **kwargs):
 
     delete = not args.no_delete
 
-    _rebuild(output_dir, delete)
+    profiler.enabled = args.profile
+    try:
+        writer = _rebuild(output_dir, delete)
+    except RenderError as e:
+        render_error_report([e.args[0]])
+        sys.exit("Build stopped at the first template that failed to render")
+    print(
+        "Rendered {0} outputs, skipped {1} unchanged".format(
+            writer.manifest.rendered, writer.manifest.skipped
+        )
+    )
+    print(
+        "Filter cache: {0} hits, {1} misses".format(
+            filter.chain_cache.hits, filter.chain_cache.misses
+        )
+    )
+    print(
+        "Output cache: {0} hits, {1} misses".format(
+            writer.output_cache.hits, writer.output_cache.misses
+        )
+    )
+    if args.profile:
+        profile_report(args)
+    if writer.render_errors:
+        render_error_report(writer.render_errors)
+        if config.site.render_errors != "continue" and not args.serve:
+            sys.exit(
+                "Build failed: {0} template(s) failed to render".format(
+                    len(writer.render_errors)
+                )
+            )
 
     if args.serve:
         bfserver = server.Server(args.PORT, args.IP_ADDR)
         bfserver.start()
-        state = {}
+        src_watcher = watcher.get_watcher()
         while not bfserver.is_shutdown:
             try:
-                time.sleep(0.5)
-                _check_output(state, output_dir, delete)
+                changed = src_watcher.wait(0.5)
+                if changed:
+                    logger.info(
+                        "Files changed: %s", ", ".join(sorted(changed))
+                    )
+                    print(
+                        "File changes detected, rebuilding...",
+                        end="",
+                        flush=True,
+                    )
+                    writer = _rebuild(output_dir, delete, changed)
+                    code_changes = _code_changes(changed)
+                    if code_changes:
+                        print(
+                            "\nController / filter code changed ({0}); "
+                            "restart zeekofile to use it".format(
+                                ", ".join(code_changes)
+                            ),
+                            flush=True,
+                        )
+                    bfserver.invalidate()
+                    bfserver.notify(
+                        util.site_path_helper(*location.split(os.sep))
+                        for location in writer.changed_outputs
+                    )
+                    print(
+                        "...done! (rendered {0}, skipped {1})".format(
+                            writer.manifest.rendered, writer.manifest.skipped
+                        ),
+                        flush=True,
+                    )
+                    if args.profile:
+                        profile_report(args)
+                    if writer.render_errors:
+                        render_error_report(writer.render_errors)
             except KeyboardInterrupt:
                 bfserver.shutdown()
+            except RenderError as e:
+                render_error_report([e.args[0]])
             except:
                 print(traceback.print_exc())
+        src_watcher.close()
+
+
+def render_error_report(errors):
+    print("Templates that failed to render:")
+    for error in errors:
+        print(
+            "  {0} -> {1}: {2}".format(
+                error["template"], error["location"], error["error"]
+            )
+        )
+        print("    context: {0}".format(", ".join(error["context"]) or "-"))
+
+
+def profile_report(args):
+    profiler.print_report(args.profile_top)
+    path = args.profile_output or util.path_join(
+        config.site.cache_dir, "profile.json"
+    )
+    profiler.write_report(path)
+    print("Profile written to {0}".format(path))
 
 
 def config_init(args):
@@ -0,0 +1,300 @@
+"""
+manifest.py keeps a persistent record of what each rendered file in _site
+was built from.
+
+For every output the manifest remembers a key made from the template name,
+the template attributes and the site-wide inputs (config, code, post
+metadata), along with the templates and post sources that were actually read
+while rendering it.  The ``<%inherit>`` / ``<%include>`` chain is picked up as
+the templates are resolved through the ``TemplateLookup``, and post sources
+are picked up as ``post.content`` is read.  On the next build an output whose
+key, templates and sources are all unchanged is reused instead of rendered.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+from . import util
+from .cache import zf
+
+zf.manifest = sys.modules["zeekofile.manifest"]
+
+logger = logging.getLogger("zeekofile.manifest")
+
+MANIFEST_VERSION = 1
+
+_local = threading.local()
+
+
+def digest(*parts):
+    """Return a hex sha1 of the given strings / bytes"""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_digest(path):
+    """Return a hex sha1 of a file's contents, or None if it's missing"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def fingerprint(obj, memo=None):
+    """Return a stable string identifying a template attribute.
+
+    Objects may provide their own ``fingerprint()`` method; anything that
+    isn't plain data falls back to ``repr()``, which for most objects
+    includes the object id and so never matches a previous build.
+
+    >>> fingerprint({"b": [1, "two"], "a": None})
+    "{'a':None,'b':[1,'two']}"
+    """
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return repr(obj)
+    if memo is not None and id(obj) in memo:
+        return memo[id(obj)][1]
+    if isinstance(obj, dict):
+        fp = "{%s}" % ",".join(
+            "%s:%s" % (fingerprint(k, memo), fingerprint(v, memo))
+            for k, v in sorted(obj.items(), key=lambda item: repr(item[0]))
+        )
+    elif isinstance(obj, (list, tuple)):
+        fp = "[%s]" % ",".join(fingerprint(o, memo) for o in obj)
+    elif isinstance(obj, (set, frozenset)):
+        fp = "{%s}" % ",".join(sorted(fingerprint(o, memo) for o in obj))
+    elif hasattr(obj, "fingerprint") and callable(obj.fingerprint):
+        fp = obj.fingerprint()
+    else:
+        fp = repr(obj)
+    if memo is not None:
+        # hold onto obj so that its id() can't be reused within this build
+        memo[id(obj)] = (obj, fp)
+    return fp
+
+
+def record_template(filename):
+    """Note that the output currently being rendered read a template"""
+    recorder = getattr(_local, "recorder", None)
+    if recorder is not None and filename:
+        recorder.templates.add(filename)
+
+
+def record_source(source_digest):
+    """Note that the output currently being rendered read a source, such as
+    the content of a post"""
+    recorder = getattr(_local, "recorder", None)
+    if recorder is not None:
+        recorder.sources.add(source_digest)
+
+
+@contextlib.contextmanager
+def capturing():
+    """Capture the templates and sources read within the block, so that
+    they can be replay()ed wherever its result is reused; they're also
+    recorded for the current output as usual"""
+    recorder = _Recorder()
+    prev = getattr(_local, "recorder", None)
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = prev
+        replay(recorder)
+
+
+def replay(captured):
+    """Record what a capturing() block read, for the current output"""
+    recorder = getattr(_local, "recorder", None)
+    if recorder is not None:
+        recorder.templates.update(captured.templates)
+        recorder.sources.update(captured.sources)
+
+
+class _Recorder(object):
+    def __init__(self):
+        self.templates = set()
+        self.sources = set()
+
+
+class Manifest(object):
+    """The build manifest for one build of the site"""
+
+    def __init__(self, path, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.previous, self.previous_inputs = (
+            self._load() if enabled else ({}, {})
+        )
+        self.outputs = {}
+        self.inputs = {}
+        self.sources = set()
+        self.rendered = 0
+        self.skipped = 0
+        self._file_digests = {}
+        self._memo = {}
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}, {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Discarding unreadable manifest %s", self.path)
+            return {}, {}
+        if data.get("version") != MANIFEST_VERSION:
+            return {}, {}
+        return data["outputs"], data["inputs"]
+
+    def save(self):
+        util.mkdir(os.path.dirname(self.path))
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "inputs": self.inputs,
+                    "outputs": self.outputs,
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+    def add_input(self, name, value):
+        """Add a site-wide input that every output depends on.
+
+        Inputs must be added before the outputs that depend on them are
+        rendered."""
+        self.inputs[name] = digest(fingerprint(value, self._memo))
+
+    def add_sources(self, source_digests):
+        """Declare the digests of the sources (posts) that exist in this
+        build"""
+        self.sources.update(source_digests)
+
+    def fingerprint(self, obj):
+        """Return fingerprint(obj), holding onto any object fingerprinted
+        by its id() until the end of the build, so that the id() can't be
+        reused by another object"""
+        return fingerprint(obj, self._memo)
+
+    def file_digest(self, path):
+        try:
+            return self._file_digests[path]
+        except KeyError:
+            d = self._file_digests[path] = file_digest(path)
+            return d
+
+    def output_key(self, template_name, attrs):
+        # template_render() adds zf and site.template_vars to the attrs it
+        # is given; those are site-wide and not part of the key
+        attrs = dict(
+            (k, v)
+            for k, v in attrs.items()
+            if k != "zf" and k not in zf.config.site.template_vars
+        )
+        return digest(
+            template_name,
+            fingerprint(sorted(self.inputs.items())),
+            fingerprint(attrs, self._memo),
+        )
+
+    def is_current(self, location, key):
+        """Return True if the previous build of location was made from the
+        same inputs as it would be now"""
+        entry = self.previous.get(location)
+        if entry is None or entry["key"] != key:
+            return False
+        for filename, file_digest in entry["templates"].items():
+            if self.file_digest(filename) != file_digest:
+                return False
+        return self.sources.issuperset(entry["sources"])
+
+    def carry_over(self):
+        """Carry the previous build's inputs and outputs forward, for an
+        update of the site that doesn't run the controllers"""
+        for name, value in self.previous_inputs.items():
+            self.inputs.setdefault(name, value)
+        self.outputs.update(self.previous)
+
+    def add_output(self, location, record):
+        """Add the record of an output rendered in a worker process"""
+        self.outputs[location] = record
+        self.rendered += 1
+
+    def add_copy(self, location):
+        """Add an output copied from another output"""
+        self.outputs[location] = {"key": None}
+
+    def discard(self, location):
+        """Drop the record of an output that failed to render, so that the
+        next build renders it again"""
+        if self.outputs.pop(location, None) is not None:
+            self.rendered -= 1
+
+    def reuse(self, location):
+        """Carry a previous build's record of location into this build"""
+        self.outputs[location] = self.previous[location]
+        self.skipped += 1
+
+    @contextlib.contextmanager
+    def recording(self, location, key):
+        """Record the templates and sources read while rendering location"""
+        recorder = _Recorder()
+        prev = getattr(_local, "recorder", None)
+        _local.recorder = recorder
+        try:
+            yield recorder
+        finally:
+            _local.recorder = prev
+        self.outputs[location] = {
+            "key": key,
+            "templates": dict(
+                (filename, self.file_digest(filename))
+                for filename in sorted(recorder.templates)
+            ),
+            "sources": sorted(recorder.sources),
+        }
+        self.rendered += 1
+
+
+def code_digest(modules):
+    """Digest the code of the given filter / controller modules"""
+    return digest(*sorted(set(module_digest(mod) for mod in modules)))
+
+
+def module_digest(mod):
+    """Digest the source files of a module, or of a package and everything
+    in its directory.
+
+    A module is digested once, when it's loaded, and the digest kept on
+    it: modules aren't reloaded, so a build must be keyed on the code
+    that's running rather than on whatever is on disk by then."""
+    try:
+        return mod.__dict__["_zeekofile_code_digest"]
+    except KeyError:
+        pass
+    paths = set()
+    filename = getattr(mod, "__file__", None)
+    if filename:
+        if os.path.basename(filename) == "__init__.py":
+            paths.update(
+                util.recursive_file_list(os.path.dirname(filename), r".*\.py$")
+            )
+        else:
+            paths.add(filename)
+    d = digest(*[p + ":" + str(file_digest(p)) for p in sorted(paths)])
+    mod._zeekofile_code_digest = d
+    return d
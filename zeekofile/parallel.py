@@ -0,0 +1,88 @@
+"""
+parallel.py runs CPU bound build work on a pool of worker processes.
+
+Workers are forked from the build process, so they start out with the loaded
+config, filters, controllers and parsed posts already in memory; only the
+work items and results travel between processes.  Where fork isn't
+available, or only one job is configured, the work runs serially instead.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import sys
+
+from . import diskcache
+from .cache import zf
+
+zf.parallel = sys.modules["zeekofile.parallel"]
+
+logger = logging.getLogger("zeekofile.parallel")
+
+# True inside a worker process
+in_worker = False
+
+# (take, add) pairs for state a worker sends back to the build process with
+# each result: take() is called in the worker, and its return value passed
+# to add() in the build process
+_worker_state = [(diskcache.take_stats, diskcache.add_stats)]
+
+
+class ProcessUnsafe(Exception):
+    """Raised inside a worker by work that must run in the build process"""
+
+
+def send_back(take, add):
+    """Have workers send back state with each result; see _worker_state"""
+    _worker_state.append((take, add))
+
+
+def _init_worker():
+    global in_worker
+    in_worker = True
+    # drop the state inherited from the build process
+    for take, add in _worker_state:
+        take()
+
+
+def _call_in_worker(func_and_item):
+    func, item = func_and_item
+    result = func(item)
+    return result, [take() for take, add in _worker_state]
+
+
+def jobs():
+    """Return the number of worker processes to use"""
+    jobs = zf.config.site.jobs
+    if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("Process pools need fork(); running with one job")
+        return 1
+    return jobs
+
+
+def map_jobs(func, items, chunksize=None):
+    """Return [func(item) for item in items], run across jobs() processes.
+
+    func must be a module level function; results come back in the order
+    of items."""
+    items = list(items)
+    if jobs() <= 1 or not items:
+        return [func(item) for item in items]
+    num_jobs = min(jobs(), len(items))
+    if chunksize is None:
+        chunksize = max(1, len(items) // (num_jobs * 4))
+    with ProcessPoolExecutor(
+        max_workers=num_jobs,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+    ) as executor:
+        results = []
+        for result, state in executor.map(
+            _call_in_worker,
+            [(func, item) for item in items],
+            chunksize=chunksize,
+        ):
+            for (take, add), value in zip(_worker_state, state):
+                add(value)
+            results.append(result)
+        return results
@@ -0,0 +1,142 @@
+"""
+profiler.py records where a build spends its time, for --profile.
+
+Wall and CPU time are totalled per build phase, controller, filter,
+template and output page; times are inclusive, so a controller's time
+includes the templates it renders.  Work done in worker processes is
+sent back to the build process and counted there, with each worker's own
+CPU time.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+
+from . import parallel
+from . import util
+from .cache import zf
+
+zf.profiler = sys.modules["zeekofile.profiler"]
+
+logger = logging.getLogger("zeekofile.profiler")
+
+KINDS = ("phase", "controller", "filter", "template", "page")
+
+enabled = False
+
+# (kind, name) -> [count, wall seconds, cpu seconds]
+timings = {}
+
+bytes_written = 0
+
+
+def reset():
+    global bytes_written
+    timings.clear()
+    bytes_written = 0
+
+
+@contextlib.contextmanager
+def timed(kind, name):
+    """Add the time spent in the block to the timings of kind / name"""
+    if not enabled:
+        yield
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        _add(
+            kind,
+            name,
+            1,
+            time.perf_counter() - wall,
+            time.process_time() - cpu,
+        )
+
+
+def _add(kind, name, count, wall, cpu):
+    try:
+        entry = timings[kind, name]
+    except KeyError:
+        entry = timings[kind, name] = [0, 0.0, 0.0]
+    entry[0] += count
+    entry[1] += wall
+    entry[2] += cpu
+
+
+def add_bytes(size):
+    """Count bytes written to the output dir or a temporary file there,
+    whether or not they end up replacing a file in the site"""
+    global bytes_written
+    if enabled:
+        bytes_written += size
+
+
+def _take():
+    taken = (list(timings.items()), bytes_written)
+    reset()
+    return taken
+
+
+def _merge(taken):
+    global bytes_written
+    items, written = taken
+    for (kind, name), (count, wall, cpu) in items:
+        _add(kind, name, count, wall, cpu)
+    bytes_written += written
+
+
+parallel.send_back(_take, _merge)
+
+
+def report():
+    """Return the timings as a dict, ready for json.dump()"""
+    result = {"bytes_written": bytes_written}
+    for kind in KINDS:
+        result[kind + "s"] = dict(
+            (
+                name,
+                {"count": count, "wall": round(wall, 6), "cpu": round(cpu, 6)},
+            )
+            for (k, name), (count, wall, cpu) in sorted(timings.items())
+            if k == kind
+        )
+    return result
+
+
+def print_report(top=15):
+    """Print the phases, then the top slowest controllers, filters,
+    templates and pages"""
+    for kind in KINDS:
+        entries = sorted(
+            (
+                (wall, cpu, count, name)
+                for (k, name), (count, wall, cpu) in timings.items()
+                if k == kind
+            ),
+            reverse=True,
+        )
+        if not entries:
+            continue
+        if kind != "phase":
+            entries = entries[:top]
+        print("Slowest {0}s:".format(kind) if kind != "phase" else "Phases:")
+        for wall, cpu, count, name in entries:
+            print(
+                "  {0:8.3f}s wall {1:8.3f}s cpu {2:6d}x  {3}".format(
+                    wall, cpu, count, name
+                )
+            )
+    print("Bytes written: {0}".format(bytes_written))
+
+
+def write_report(path):
+    util.mkdir(os.path.dirname(path) or ".")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report(), f, indent=2, sort_keys=True)
+        f.write("\n")
+    logger.info("Wrote profile to %s", path)
@@ -1,20 +1,86 @@
-from http.server import HTTPServer
+import collections
+import datetime
+import email.utils
+from http import HTTPStatus
 from http.server import SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import io
+import json
 import logging
 import os
-import re
+import stat
 import sys
 import threading
 from urllib.parse import urlparse
+from urllib.parse import urlsplit
 
 from . import config
-from . import util
 from .cache import zf
 
 zf.server = sys.modules["zeekofile.server"]
 
 logger = logging.getLogger("zeekofile.server")
 
+# files up to this size are kept in memory once served
+CACHE_FILE_SIZE = 256 * 1024
+# the most kept in memory in all; least recently served files go first
+CACHE_SIZE = 32 * 1024 * 1024
+
+# live reload: pages get a script that listens on the events URL for the
+# URL paths each rebuild changed
+EVENTS_PATH = "/__zeekofile__/events"
+SCRIPT_PATH = "/__zeekofile__/livereload.js"
+# seconds between keepalive comments on an idle events stream
+PING_INTERVAL = 15
+
+_SCRIPT_TAG = b'<script src="' + SCRIPT_PATH.encode("ascii") + b'"></script>'
+
+LIVE_RELOAD_JS = """\
+(function () {
+  if (!window.EventSource) {
+    return;
+  }
+  function normalize(path) {
+    return path.charAt(path.length - 1) === "/" ? path + "index.html" : path;
+  }
+  function pathOf(url) {
+    var a = document.createElement("a");
+    a.href = url;
+    return normalize(a.pathname);
+  }
+  var source = new EventSource("%s");
+  source.addEventListener("rebuild", function (event) {
+    var changed = {};
+    JSON.parse(event.data).forEach(function (path) {
+      changed[normalize(path)] = true;
+    });
+    if (changed[normalize(location.pathname)]) {
+      location.reload();
+      return;
+    }
+    var reload = false;
+    var links = document.querySelectorAll("link[rel~=stylesheet][href]");
+    Array.prototype.forEach.call(links, function (link) {
+      var url = link.getAttribute("href").split("?")[0];
+      if (changed[pathOf(url)]) {
+        link.href = url + "?zf=" + Date.now();
+      }
+    });
+    var others = document.querySelectorAll("script[src], img[src]");
+    Array.prototype.forEach.call(others, function (el) {
+      if (changed[pathOf(el.getAttribute("src"))]) {
+        reload = true;
+      }
+    });
+    if (reload) {
+      location.reload();
+    }
+  });
+})();
+""" % (
+    EVENTS_PATH,
+)
+
 
 class Server(threading.Thread):
 
@@ -27,9 +93,19 @@ class Server(threading.Thread):
         self.is_shutdown = False
         server_address = (address, self.port)
         HandlerClass = ZFRequestHandler
-        ServerClass = HTTPServer
-        HandlerClass.protocol_version = "HTTP/1.0"
+        ServerClass = ThreadingHTTPServer
+        HandlerClass.protocol_version = "HTTP/1.1"
         self.httpd = ServerClass(server_address, HandlerClass)
+        self.httpd.file_cache = _FileCache(CACHE_FILE_SIZE, CACHE_SIZE)
+        site_path = urlparse(config.site.url).path
+        self.httpd.site_dir = os.path.join(os.getcwd(), "_site")
+        self.httpd.routes = _routes(site_path, self.httpd.site_dir)
+        self.httpd.not_found_format = HandlerClass.error_template.format(
+            site_path, site_path
+        )
+        self.httpd.live_reload = (
+            _ReloadChannel() if config.site.live_reload else None
+        )
         self.sa = self.httpd.socket.getsockname()
 
     def run(self):
@@ -40,15 +116,107 @@ class Server(threading.Thread):
         )
         self.httpd.serve_forever()
 
+    def invalidate(self):
+        """Forget the files kept in memory, after the site is rebuilt"""
+        self.httpd.file_cache.clear()
+
+    def notify(self, paths):
+        """Tell the browsers watching the site that the given URL paths
+        were changed by a rebuild"""
+        paths = sorted(paths)
+        if self.httpd.live_reload is not None and paths:
+            self.httpd.live_reload.publish(paths)
+
     def shutdown(self):
         print("\nshutting down webserver...")
+        if self.httpd.live_reload is not None:
+            self.httpd.live_reload.close()
         self.httpd.shutdown()
         self.httpd.socket.close()
         self.is_shutdown = True
 
 
+class _FileCache(object):
+    """The contents of recently served small files, by path.
+
+    Entries are checked against the file's mtime and size, so a file
+    replaced since it was cached is read again."""
+
+    def __init__(self, max_file_size, max_size):
+        self.max_file_size = max_file_size
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, key):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != key:
+                return None
+            self.entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path, key, data):
+        if len(data) > self.max_file_size:
+            return
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[path] = (key, data)
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class _ReloadChannel(object):
+    """Rebuild events for the live reload streams.
+
+    Each event gets the next sequence number; a stream waits for events
+    newer than the last one it sent.  Only the latest event is kept, as a
+    page only needs to know about rebuilds since it was loaded."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.paths = []
+        self.closed = False
+
+    def publish(self, paths):
+        with self.condition:
+            self.seq += 1
+            self.paths = paths
+            self.condition.notify_all()
+
+    def wait(self, seq, timeout):
+        """Return (seq, paths) of an event newer than seq, or None after
+        timeout seconds"""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.seq != seq or self.closed, timeout
+            )
+            if self.seq == seq:
+                return None
+            return self.seq, self.paths
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
 class ZFRequestHandler(SimpleHTTPRequestHandler):
 
+    # close idle keep-alive connections
+    timeout = 60
+
     error_template = """
 <head>
 <title>Error response</title>
@@ -59,26 +227,187 @@ Your zeekofile site is configured for a subdirectory, maybe you were looking
 for the root page? : <a href="{0}">{1}</a>
 </body>"""
 
-    def __init__(self, *args, **kwargs):
-        path = urlparse(config.site.url).path
-        self.error_template = self.error_template.format(path, path)
-        SimpleHTTPRequestHandler.__init__(self, *args, **kwargs)
+    def __init__(self, request, client_address, server):
+        SimpleHTTPRequestHandler.__init__(
+            self, request, client_address, server, directory=server.site_dir
+        )
 
     def translate_path(self, path):
-        site_path = urlparse(config.site.url).path
-        if len(site_path.strip("/")) > 0 and not path.startswith(site_path):
-            self.error_message_format = self.error_template
-            return ""  # Results in a 404
-
-        p = SimpleHTTPRequestHandler.translate_path(self, path)
-        if len(site_path.strip("/")) > 0:
-            build_path = os.path.join(
-                os.getcwd(), util.path_join(site_path.strip("/"))
-            )
+        url_path = path.split("?", 1)[0].split("#", 1)[0]
+        for prefix, directory in self.server.routes:
+            if url_path == prefix or url_path.startswith(prefix + "/"):
+                self.directory = directory
+                return SimpleHTTPRequestHandler.translate_path(
+                    self, path[len(prefix) :]
+                )
+        self.error_message_format = self.server.not_found_format
+        return ""  # Results in a 404
+
+    def do_GET(self):
+        if not self._live_reload_request():
+            SimpleHTTPRequestHandler.do_GET(self)
+
+    def do_HEAD(self):
+        if not self._live_reload_request(head=True):
+            SimpleHTTPRequestHandler.do_HEAD(self)
+
+    def _live_reload_request(self, head=False):
+        """Answer the live reload URLs; return False for any other URL"""
+        channel = self.server.live_reload
+        if channel is None:
+            return False
+        path = urlsplit(self.path).path
+        if path == SCRIPT_PATH:
+            data = LIVE_RELOAD_JS.encode("utf-8")
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-type", "application/javascript")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(data)
+            return True
+        if path != EVENTS_PATH:
+            return False
+        self.close_connection = True
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if head:
+            return True
+        seq = channel.seq
+        try:
+            self.wfile.write(b"retry: 1000\n\n")
+            self.wfile.flush()
+            while not channel.closed:
+                event = channel.wait(seq, PING_INTERVAL)
+                if event is None:
+                    self.wfile.write(b": ping\n\n")
+                elif not channel.closed:
+                    seq, paths = event
+                    self.wfile.write(
+                        "event: rebuild\ndata: {0}\n\n".format(
+                            json.dumps(paths)
+                        ).encode("utf-8")
+                    )
+                self.wfile.flush()
+        except (ConnectionError, OSError):
+            # the browser went away
+            pass
+        return True
+
+    def send_head(self):
+        """Serve files with an ETag and Last-Modified, answering
+        conditional requests with 304 Not Modified, and small files from
+        memory.  Directory redirects, listings and errors are left to
+        SimpleHTTPRequestHandler."""
+        path = self.translate_path(self.path)
+        if not path or urlsplit(self.path).path.endswith("/"):
+            if not os.path.isdir(path):
+                return SimpleHTTPRequestHandler.send_head(self)
+            for index in "index.html", "index.htm":
+                index = os.path.join(path, index)
+                if os.path.isfile(index):
+                    path = index
+                    break
+            else:
+                return SimpleHTTPRequestHandler.send_head(self)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return SimpleHTTPRequestHandler.send_head(self)
+        if not stat.S_ISREG(st.st_mode):
+            return SimpleHTTPRequestHandler.send_head(self)
+
+        key = (st.st_mtime_ns, st.st_size)
+        if self._not_modified(_etag(key), st.st_mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_validators(key, st.st_mtime)
+            self.end_headers()
+            return None
+
+        file_cache = self.server.file_cache
+        data = file_cache.get(path, key)
+        if data is not None:
+            f = io.BytesIO(data)
         else:
-            build_path = os.getcwd()
-        build_path = re.sub(build_path, os.path.join(os.getcwd(), "_site"), p)
-        return build_path
+            try:
+                f = open(path, "rb")
+            except OSError:
+                self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+                return None
+            fs = os.fstat(f.fileno())
+            # the file may have been replaced since it was stat()ed
+            key = (fs.st_mtime_ns, fs.st_size)
+            st = fs
+            if fs.st_size <= file_cache.max_file_size:
+                data = f.read()
+                f.close()
+                file_cache.put(path, key, data)
+                f = io.BytesIO(data)
+        ctype = self.guess_type(path)
+        length = key[1]
+        if self.server.live_reload is not None and ctype == "text/html":
+            if data is None:
+                with f:
+                    data = f.read()
+            data = _inject_script(data)
+            f = io.BytesIO(data)
+            length = len(data)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-type", ctype)
+        self.send_header("Content-Length", str(length))
+        self._send_validators(key, st.st_mtime)
+        self.end_headers()
+        return f
+
+    def _send_validators(self, key, mtime):
+        self.send_header("ETag", _etag(key))
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        # always check back, so that a rebuilt page shows up straight away
+        self.send_header("Cache-Control", "no-cache")
+
+    def _not_modified(self, etag, mtime):
+        if "If-None-Match" in self.headers:
+            tags = [
+                t.strip() for t in self.headers["If-None-Match"].split(",")
+            ]
+            return "*" in tags or etag in tags or "W/" + etag in tags
+        if "If-Modified-Since" in self.headers:
+            try:
+                ims = email.utils.parsedate_to_datetime(
+                    self.headers["If-Modified-Since"]
+                )
+            except (TypeError, IndexError, OverflowError, ValueError):
+                return False
+            if ims.tzinfo is None:
+                ims = ims.replace(tzinfo=datetime.timezone.utc)
+            return int(mtime) <= ims.timestamp()
+        return False
 
     def log_message(self, format, *args):
         pass
+
+
+def _routes(site_path, site_dir):
+    """Return the (URL prefix, directory) table for serving the site, with
+    the longest prefixes first.  A prefix matches a URL path that equals
+    it or continues it with a "/"."""
+    prefix = "/".join(p for p in site_path.split("/") if p)
+    routes = {"/" + prefix if prefix else "": site_dir}
+    return sorted(
+        routes.items(), key=lambda route: len(route[0]), reverse=True
+    )
+
+
+def _inject_script(html):
+    """Add the live reload script tag to a page, before its </body>"""
+    index = html.lower().rfind(b"</body>")
+    if index == -1:
+        return html + _SCRIPT_TAG
+    return html[:index] + _SCRIPT_TAG + html[index:]
+
+
+def _etag(key):
+    return '"{0:x}-{1:x}"'.format(*key)
@@ -58,7 +58,12 @@ def mkdir(newdir):
             mkdir(head)
         # print "mkdir {0}.format(repr(newdir))
         if tail:
-            os.mkdir(newdir)
+            try:
+                os.mkdir(newdir)
+            except FileExistsError:
+                # created meanwhile by another build process
+                if not os.path.isdir(newdir):
+                    raise
 
 
 def url_path_helper(*parts):
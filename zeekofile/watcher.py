@@ -0,0 +1,234 @@
+"""
+watcher.py watches the site's source tree for changes while --serve is
+running.
+
+On Linux the watcher is driven by inotify events; elsewhere, or if inotify
+can't be set up, it falls back to polling the mtimes of every source file.
+Either way a burst of changes, such as an editor saving several files, is
+collected into one set of changed paths.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from . import util
+from .cache import zf
+from .writer import _is_ignored_dir
+from .writer import _walk_dirs
+
+zf.watcher = sys.modules["zeekofile.watcher"]
+
+logger = logging.getLogger("zeekofile.watcher")
+
+# reported as the changed path when changes were missed, such as when the
+# inotify event queue overflows; anything may have changed
+EVERYTHING = "."
+
+# the config file lives at the top of the source dir, where it's otherwise
+# ignored as a file starting with an underscore
+CONFIG_FILE = "_config.py"
+
+
+def _is_watched(root, name):
+    if root == "." and name == CONFIG_FILE:
+        return True
+    return not util.should_ignore_path(util.path_join(root, name))
+
+
+def _watched_dirs(top="."):
+    cache_dir = os.path.abspath(zf.config.site.cache_dir)
+    for root, files in _walk_dirs(True, top):
+        path = os.path.abspath(root)
+        if path == cache_dir or path.startswith(cache_dir + os.sep):
+            continue
+        yield root, files
+
+
+class PollingWatcher(object):
+    """Watch for changes by comparing file mtimes every interval seconds"""
+
+    def __init__(self, interval=0.5, debounce=0.2):
+        self.interval = interval
+        self.debounce = debounce
+        self.state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for root, files in _watched_dirs():
+            for name in files:
+                if _is_watched(root, name):
+                    path = util.path_join(root, name)
+                    try:
+                        state[path] = os.stat(path).st_mtime
+                    except OSError:
+                        pass
+        return state
+
+    def _changes(self):
+        state = self._scan()
+        changed = set(
+            path
+            for path in set(state) | set(self.state)
+            if state.get(path) != self.state.get(path)
+        )
+        self.state = state
+        return changed
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for changes, returning the set of
+        changed paths"""
+        time.sleep(min(timeout, self.interval))
+        changed = self._changes()
+        while changed:
+            time.sleep(self.debounce)
+            more = self._changes()
+            if not more:
+                break
+            changed.update(more)
+        return changed
+
+    def close(self):
+        pass
+
+
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    _IN_CLOSE_WRITE
+    | _IN_ATTRIB
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+)
+
+_event_header = struct.Struct("iIII")
+
+
+class InotifyWatcher(object):
+    """Watch for changes with Linux inotify"""
+
+    def __init__(self, debounce=0.2):
+        self.debounce = debounce
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> directory, in the form _walk_dirs() gives
+        self.dirs = {}
+        for root, files in _watched_dirs():
+            self._add_watch(root)
+
+    def _add_watch(self, root):
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(root), _WATCH_MASK
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(
+                    err,
+                    "inotify watch limit reached; "
+                    "see /proc/sys/fs/inotify/max_user_watches",
+                )
+            logger.debug("Can't watch %s: %s", root, os.strerror(err))
+            return
+        self.dirs[wd] = root
+
+    def _watch_new_dir(self, path, changed):
+        """Watch a directory created since the watcher started, reporting
+        the files already in it"""
+        for root, files in _watched_dirs(path):
+            self._add_watch(root)
+            for name in files:
+                if _is_watched(root, name):
+                    changed.add(util.path_join(root, name))
+
+    def _read_events(self, changed):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed")
+                changed.add(EVERYTHING)
+                continue
+            root = self.dirs.get(wd)
+            if root is None:
+                continue
+            if mask & _IN_IGNORED:
+                del self.dirs[wd]
+                continue
+            if not name:
+                continue
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    if not _is_ignored_dir(root, name, True):
+                        self._watch_new_dir(
+                            util.path_join(root, name), changed
+                        )
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    changed.add(EVERYTHING)
+            elif _is_watched(root, name):
+                changed.add(util.path_join(root, name))
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for changes, returning the set of
+        changed paths"""
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+        self._read_events(changed)
+        # keep collecting until the burst of events has gone quiet
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], self.debounce)
+            if not ready:
+                break
+            self._read_events(changed)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher():
+    """Return an InotifyWatcher where possible, else a PollingWatcher"""
+    kind = zf.config.site.watcher
+    debounce = zf.config.site.watch_debounce
+    if kind in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(debounce=debounce)
+        except OSError as e:
+            logger.warning("Can't use inotify (%s), polling instead", e)
+    return PollingWatcher(debounce=debounce)
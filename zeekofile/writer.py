@@ -6,70 +6,132 @@ writer.py writes out the static blog to ./_site based on templates found in the
 current working directory.
 """
 
+import contextlib
+import hashlib
+import json
 import logging
 import os
+import posixpath
 import shutil
-import stat
+import sys
 import tempfile
 
 from mako import exceptions as mako_exceptions
+from mako import runtime as mako_runtime
 from mako.lookup import TemplateLookup
 from mako.template import Template
 
 from . import cache
 from . import config
 from . import controller
+from . import copier
+from . import diskcache
 from . import filter
+from . import manifest
+from . import parallel
+from . import profiler
 from . import util
 
 
 logger = logging.getLogger("zeekofile.writer")
 
 
-def _file_mtime(f):
-    if not os.path.exists(f):
-        return None
-    else:
-        st = os.stat(f)
-        return st[stat.ST_MTIME]
-
-
-def _check_output(state, output_dir, delete):
-    starting = not (state)
-    for src, dest in _walk_files(output_dir, True):
-        src_mtime = _file_mtime(src)
-        if starting:
-            state[src] = src_mtime
-        elif src_mtime > state.get(src, 0):
-            logger.info("File %s changed since start", src)
-            state[src] = src_mtime
-            print("File changes detected, rebuilding...", end="", flush=True)
-            _rebuild(output_dir, delete)
-            print("...done!", flush=True)
-            break
-
-
-def _rebuild(output_dir, delete):
-    writer = Writer()
-    writer.write_site(output_dir, delete)
-
-
-def _walk_files(output_dir, include_src_templates):
-
-    for root, dirs, files in os.walk("."):
+class RenderError(Exception):
+    """Raised at the first failed render when site.render_errors is
+    "stop"; its argument is the error's record, as in
+    Writer.render_errors"""
+
+
+class NestedRenderError(Exception):
+    """Raised from within a template when a template it rendered in turn,
+    as through Post.render(), failed; that failure has already been
+    reported, so the enclosing render just fails with it"""
+
+
+def _rebuild(output_dir, delete, changed_paths=None):
+    profiler.reset()
+    writer = Writer(changed_paths)
+    with profiler.timed("phase", "total"):
+        if changed_paths is None:
+            writer.write_site(output_dir, delete)
+        else:
+            writer.update_site(output_dir, delete)
+    return writer
+
+
+# changes to these need everything rebuilt
+_config_file = "_config.py"
+_code_dirs = ("_controllers", "_filters")
+
+
+def _code_changes(changed_paths):
+    """Return the changed paths that are controller or filter code, which
+    only takes effect once zeekofile is restarted"""
+    return sorted(
+        path for path in changed_paths if path.split(os.sep)[0] in _code_dirs
+    )
+
+
+def _classify_changes(changed_paths):
+    """Sort changed source paths by what they affect.
+
+    Returns (static, pages, sources): static files to copy, standalone
+    .mako pages to render, and other sources (posts, templates...) that
+    mean running the controllers.  Returns None if a full build is needed,
+    for changes to the config or to controller or filter code."""
+    static, pages, sources = set(), set(), set()
+    for path in changed_paths:
+        parts = path.split(os.sep)
+        if path in (".", _config_file) or parts[0] in _code_dirs:
+            return None
+        elif parts[0].startswith("_site"):
+            continue
+        elif any(part.startswith("_") for part in parts[:-1]):
+            sources.add(path)
+        elif util.should_ignore_path(util.path_join(".", path)):
+            continue
+        elif path.endswith(".mako"):
+            pages.add(path)
+        else:
+            static.add(path)
+    return static, pages, sources
+
+
+def _is_ignored_dir(root, d, include_src_templates):
+    """Return True if directory d within root is left out of the build.
+
+    With include_src_templates, directories starting with an underscore
+    (templates, posts, controllers...) are included, other than _site."""
+    d_path = util.path_join(root, d)
+    return util.should_ignore_path(d_path) and (
+        not include_src_templates
+        or not d.startswith("_")
+        or d.startswith("_site")
+    )
+
+
+def _walk_dirs(include_src_templates, top="."):
+    """Walk the source tree, yielding (root, files) for each directory that
+    isn't ignored"""
+
+    cache_dir = os.path.abspath(config.site.cache_dir)
+    for root, dirs, files in os.walk(top):
         if root.startswith("./"):
             root = root[2:]
 
         for d in list(dirs):
-            # Exclude some dirs
-            d_path = util.path_join(root, d)
-            if util.should_ignore_path(d_path) and (
-                not include_src_templates
-                or not d.startswith("_")
-                or d.startswith("_site")
-            ):
+            # Exclude some dirs, and the cache dir wherever it is
+            if _is_ignored_dir(
+                root, d, include_src_templates
+            ) or cache_dir == os.path.abspath(os.path.join(root, d)):
                 dirs.remove(d)
 
+        yield root, files
+
+
+def _walk_files(output_dir, include_src_templates):
+
+    for root, files in _walk_dirs(include_src_templates):
         for t_fn in files:
             t_fn_path = util.path_join(root, t_fn)
             if util.should_ignore_path(t_fn_path):
@@ -86,91 +148,561 @@ def _walk_files(output_dir, include_src_templates):
                 yield f_path, out_path
 
 
+def _same_contents(path, data):
+    """Return True if the file at path holds exactly data, judged by size
+    and then digest"""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+    except OSError:
+        return False
+    return manifest.file_digest(path) == hashlib.sha1(data).hexdigest()
+
+
+def _same_files(path, other):
+    """Return True if two files have the same contents, judged by size and
+    then digest"""
+    try:
+        st, other_st = os.stat(path), os.stat(other)
+    except OSError:
+        return False
+    if os.path.samestat(st, other_st):
+        return True
+    if st.st_size != other_st.st_size:
+        return False
+    return manifest.file_digest(path) == manifest.file_digest(other)
+
+
+def _render_to_stream(template, attrs, out):
+    """Render a template into the file-like out, as render_unicode() would
+    render it into a string.
+
+    Mako has no public API for this, so this does what
+    mako.runtime._render() does for render_unicode(), relying on two
+    private details of Mako 1.x: Context._outputting_as_unicode, which
+    makes a failed render's error page a str rather than bytes, and
+    runtime._kwargs_for_callable(), which passes the template body the
+    attrs it takes.  Keep everything that depends on them here."""
+    context = mako_runtime.Context(out, **attrs)
+    context._outputting_as_unicode = True
+    template.render_context(
+        context,
+        **mako_runtime._kwargs_for_callable(template.callable_, attrs),
+    )
+
+
+def _render_queued(index):
+    """Run one of the writer's queued renders in a worker process"""
+    writer = cache.zf.writer
+    method_name, args = writer._render_queue[index]
+    getattr(writer, method_name)(*args)
+    location = args[0]
+    # None if the render failed
+    return writer.manifest.outputs.get(location)
+
+
+def _take_written():
+    writer = cache.zf.writer
+    written, writer._written = writer._written, set()
+    changed, writer.changed_outputs = writer.changed_outputs, set()
+    return written, changed
+
+
+def _add_written(written_changed):
+    written, changed = written_changed
+    cache.zf.writer._written.update(written)
+    cache.zf.writer.changed_outputs.update(changed)
+
+
+# files written in worker processes, including those written by filters
+# while posts are parsed, count as written (and changed) by the build
+parallel.send_back(_take_written, _add_written)
+
+
+def _take_render_errors():
+    writer = cache.zf.writer
+    errors, writer.render_errors = writer.render_errors, []
+    return errors
+
+
+def _add_render_errors(errors):
+    cache.zf.writer.render_errors.extend(errors)
+
+
+parallel.send_back(_take_render_errors, _add_render_errors)
+
+
+class _TemplateLookup(TemplateLookup):
+    """TemplateLookup that records each template it resolves, including
+    those pulled in by <%inherit> and <%include>, in the build manifest.
+
+    Templates are compiled to Python modules under module_directory, named
+    for a digest of their source, so a compiled module is reused by later
+    builds for as long as its template is unchanged."""
+
+    def __init__(self, module_directory, page_module_directory, **kw):
+        TemplateLookup.__init__(
+            self,
+            module_directory=module_directory,
+            modulename_callable=self._module_filename,
+            **kw,
+        )
+        self.page_module_directory = page_module_directory
+
+    def _module_filename(self, filename, uri, module_directory=None):
+        # Mako's own check only compares whole-second mtimes, which misses
+        # a template edited within a second of its last build
+        return os.path.join(
+            module_directory or self.module_directory,
+            "%s.%s.py"
+            % (
+                posixpath.normpath(uri).lstrip("/"),
+                manifest.file_digest(filename),
+            ),
+        )
+
+    def get_template(self, uri):
+        template = TemplateLookup.get_template(self, uri)
+        manifest.record_template(template.filename)
+        return template
+
+    def prune_modules(self):
+        """Delete compiled modules left behind by earlier versions of a
+        template, keeping the newest module of each"""
+        for directory in (self.module_directory, self.page_module_directory):
+            newest = {}
+            for path in util.recursive_file_list(directory, r".*\.py$"):
+                template = path.rsplit(".", 2)[0]
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                if template in newest:
+                    other_mtime, other = newest[template]
+                    if other_mtime > mtime:
+                        os.remove(path)
+                        continue
+                    os.remove(other)
+                newest[template] = mtime, path
+
+    def get_page(self, filename):
+        """Return the Template for a standalone .mako page.
+
+        Pages are rendered with strict_undefined, so they're compiled apart
+        from the templates this lookup serves, into page_module_directory;
+        the templates they inherit or include still come from the lookup.
+        """
+        return Template(
+            filename=filename,
+            uri=filename,
+            lookup=self,
+            input_encoding="utf-8",
+            output_encoding=None,
+            strict_undefined=True,
+            module_filename=self._module_filename(
+                filename, filename, self.page_module_directory
+            ),
+        )
+
+
 class Writer(object):
 
-    def __init__(self):
+    def __init__(self, changed_paths=None):
         self.config = config
+        # the source paths changed since the last build, when known
+        if changed_paths is not None:
+            changed_paths = set(os.path.normpath(p) for p in changed_paths)
+        self.changed_paths = changed_paths
         # Base templates are templates (usually in ./_templates) that are only
         # referenced by other templates.
         self.base_template_dir = util.path_join(".", "_templates")
-        self.output_dir = tempfile.mkdtemp()
-        self.template_lookup = TemplateLookup(
+        self.output_dir = None
+        # Templates are compiled to Python modules kept in the cache dir, and
+        # recompiled only when their source is newer than the module.
+        module_dir = util.path_join(self.config.site.cache_dir, "mako")
+        self.template_lookup = _TemplateLookup(
             directories=[".", self.base_template_dir],
             input_encoding="utf-8",
             output_encoding="utf-8",
             encoding_errors="replace",
+            module_directory=module_dir,
+            page_module_directory=module_dir + "-pages",
         )
+        # renders waiting to run on the process pool, and output copies
+        # waiting on them; None when rendering immediately
+        self._render_queue = None
+        self._queued_copies = None
+        # locations of the files written to the output dir by this build
+        self._written = set()
+        # locations of the files in the site dir this build changed or
+        # deleted
+        self.changed_outputs = set()
+        # a record of each failed render: {"template", "location",
+        # "context", "error"}
+        self.render_errors = []
+        # the location being rendered, for the record of a failed render,
+        # and whether any render has failed within it
+        self._location = None
+        self._failed = False
 
     def _load_zf_cache(self):
         self.zf = cache.zf
         self.zf.writer = self
         self.zf.logger = logger
 
+    def _init_manifest(self):
+        self.manifest = manifest.Manifest(
+            util.path_join(self.config.site.cache_dir, "manifest.json"),
+            enabled=self.config.site.incremental,
+        )
+        self.manifest.add_input("config", self.config.digest())
+        self.output_cache = diskcache.DiskCache(
+            "outputs",
+            util.path_join(self.config.site.cache_dir, "outputs"),
+            self.config.site.output_cache_size,
+        )
+
     def write_site(self, output_dir, delete=True):
+        self.site_dir = output_dir
+        if self.config.site.write_mode == "direct":
+            self.output_dir = output_dir
+        else:
+            self.output_dir = self._make_stage_dir()
+        try:
+            self._load_zf_cache()
+            self._init_manifest()
+            if parallel.jobs() > 1:
+                self._render_queue = []
+                self._queued_copies = []
+            with profiler.timed("phase", "init"):
+                self._init_filters_controllers()
+            with profiler.timed("phase", "controllers"):
+                self._run_controllers()
+            with profiler.timed("phase", "write_files"):
+                self._write_files()
+            with profiler.timed("phase", "render_queue"):
+                self._run_render_queue()
+            with profiler.timed("phase", "move_to_site"):
+                if self.output_dir != self.site_dir:
+                    self._move_to_site(delete)
+                elif delete:
+                    self._delete_other_files(self._written)
+        finally:
+            if self.output_dir != self.site_dir:
+                shutil.rmtree(self.output_dir, ignore_errors=True)
+        with profiler.timed("phase", "save"):
+            self.manifest.save()
+            for c in diskcache.caches.values():
+                c.prune()
+            self.template_lookup.prune_modules()
+
+    def _make_stage_dir(self):
+        """Make a directory to render into on the same filesystem as the
+        site dir, so that outputs can be moved into place, not copied"""
+        util.mkdir(self.site_dir)
+        cache_dir = self.config.site.cache_dir
+        util.mkdir(cache_dir)
+        if os.stat(cache_dir).st_dev == os.stat(self.site_dir).st_dev:
+            parent = cache_dir
+        else:
+            parent = os.path.dirname(os.path.abspath(self.site_dir))
+        # named like _site so that it's never mistaken for a source dir
+        return tempfile.mkdtemp(prefix="_site.stage-", dir=parent)
+
+    def update_site(self, output_dir, delete=True):
+        """Bring output_dir up to date with the changes in changed_paths,
+        writing into it directly.
+
+        A changed static file is copied alone and a changed .mako page is
+        rendered alone.  Changes to posts, templates or other sources run
+        the controllers and render every page against the build manifest,
+        so that only the outputs depending on the change are rendered.
+        Changes to the config, controllers or filters mean a full build."""
+        if not self.config.site.incremental:
+            return self.write_site(output_dir, delete)
+        changes = _classify_changes(self.changed_paths)
+        if changes is None:
+            if _config_file in self.changed_paths:
+                logger.info("Reloading %s", _config_file)
+                self.config.init(_config_file)
+            # nothing from the last build can be reused
+            self.changed_paths = None
+            return self.write_site(output_dir, delete)
+        static, pages, sources = changes
+
+        self.site_dir = self.output_dir = output_dir
         self._load_zf_cache()
-        self._init_filters_controllers()
-        self._run_controllers()
-        self._write_files()
-        self._copy_to_site(output_dir, delete)
+        self._init_manifest()
+        if sources:
+            if parallel.jobs() > 1:
+                self._render_queue = []
+                self._queued_copies = []
+            with profiler.timed("phase", "init"):
+                self._init_filters_controllers()
+            with profiler.timed("phase", "controllers"):
+                self._run_controllers()
+            with profiler.timed("phase", "write_files"):
+                self._write_files(copy_static=False)
+            with profiler.timed("phase", "render_queue"):
+                self._run_render_queue()
+            if delete:
+                self._delete_stale_outputs()
+        else:
+            # outputs not being re-rendered stay as they are
+            self.manifest.carry_over()
+            filter.init_filters()
+            with profiler.timed("phase", "write_files"):
+                for path in pages:
+                    self._update_page(path)
+        with profiler.timed("phase", "copy_static"):
+            for path in static:
+                self._update_static(path)
+        with profiler.timed("phase", "save"):
+            self.manifest.save()
+            for c in diskcache.caches.values():
+                c.prune()
+
+    def _update_static(self, path):
+        dest = util.path_join(self.output_dir, path)
+        if os.path.exists(path):
+            util.mkdir(os.path.dirname(dest))
+            self.copyfile(path, dest)
+        elif os.path.exists(dest):
+            logger.info("Deleting: %s", dest)
+            os.remove(dest)
+            self._site_changed(dest)
+
+    def _update_page(self, path):
+        dest = util.path_join(self.output_dir, path[:-5])
+        location = self._output_location(dest)
+        if os.path.exists(path):
+            util.mkdir(os.path.dirname(dest))
+            self._write_page(
+                location, self.manifest.output_key(path, {}), path, dest
+            )
+        else:
+            self.manifest.outputs.pop(location, None)
+            if os.path.exists(dest):
+                logger.info("Deleting: %s", dest)
+                os.remove(dest)
+                self._site_changed(dest)
+
+    def _delete_stale_outputs(self):
+        """Delete outputs of the previous build that this build didn't
+        produce"""
+        for location in set(self.manifest.previous) - set(
+            self.manifest.outputs
+        ):
+            path = util.path_join(self.output_dir, location)
+            if os.path.exists(path):
+                logger.info("Deleting: %s", path)
+                os.remove(path)
+                self._site_changed(path)
+
+    def _queue_render(self, method, *args):
+        if self._render_queue is None:
+            method(*args)
+        else:
+            self._render_queue.append((method.__name__, args))
+
+    def _run_render_queue(self):
+        """Render everything queued by materialize_template() and
+        _write_files() on the process pool.
+
+        Each render runs in a worker forked from this process after the
+        controllers have run, so it sees the same zf state that a render
+        at the point it was queued would have seen."""
+        if self._render_queue is None:
+            return
+        logger.info(
+            "Rendering %d templates with %d jobs",
+            len(self._render_queue),
+            parallel.jobs(),
+        )
+        records = parallel.map_jobs(
+            _render_queued, range(len(self._render_queue))
+        )
+        for (method_name, args), record in zip(self._render_queue, records):
+            if record is not None:
+                self.manifest.add_output(args[0], record)
+        copies = self._queued_copies
+        self._render_queue = self._queued_copies = None
+        for location, to_location in copies:
+            self.copy_output(location, to_location)
+
+    def copy_output(self, location, to_location):
+        """Copy an output to another location in the output dir, once it
+        has been written.  Nothing is copied if the output failed to
+        render."""
+        if self._queued_copies is not None:
+            self._queued_copies.append((location, to_location))
+            return
+        src = util.path_join(self.output_dir, location)
+        path = util.path_join(self.output_dir, to_location)
+        if self._output_location(src) not in self._written:
+            logger.warning(
+                "Not copying %s to %s, as it wasn't written",
+                location,
+                to_location,
+            )
+            self.manifest.outputs.pop(self._output_location(path), None)
+            return
+        self.copyfile(src, path)
+        self.manifest.add_copy(self._output_location(path))
 
     def copyfile(self, src, dest):
-        logger.debug("Copying file: " + src)
-        shutil.copyfile(src, dest)
-
-    def _copy_to_site(self, output_dir, delete):
-        files_ = []
-        self._copytree(self.output_dir, output_dir, files_)
+        """Copy src to dest in the output dir, unless the site dir already
+        has a copy of the same size and mtime there"""
+        self._written.add(self._output_location(dest))
+        site_path = self._site_path(dest)
+        if copier.is_current(src, site_path):
+            if site_path != dest:
+                self._link_or_copy(site_path, dest)
+            return
+        method = copier.copy_file(src, dest)
+        logger.debug("Copied file (%s): %s", method, src)
+        if self.output_dir == self.site_dir:
+            self._site_changed(dest)
+
+    def write_output(self, path, text):
+        """Write text to path in the output dir, unless the site dir already
+        has the same contents there"""
+        data = text.encode("utf-8")
+        self._written.add(self._output_location(path))
+        site_path = self._site_path(path)
+        util.mkdir(os.path.dirname(path))
+        if _same_contents(site_path, data):
+            if site_path != path:
+                self._link_or_copy(site_path, path)
+            return
+        if self.output_dir == self.site_dir:
+            tmp = path + ".zeekofile-tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._site_changed(path)
+        else:
+            with open(path, "wb") as f:
+                f.write(data)
+        profiler.add_bytes(len(data))
+
+    def _write_file(self, src, path):
+        """Put the file at src at path in the output dir, unless the site
+        dir already has the same contents there"""
+        self._written.add(self._output_location(path))
+        site_path = self._site_path(path)
+        util.mkdir(os.path.dirname(path))
+        if _same_files(src, site_path):
+            if site_path != path:
+                self._link_or_copy(site_path, path)
+            return
+        tmp = path + ".zeekofile-tmp"
+        self._link_or_copy(src, tmp)
+        os.replace(tmp, path)
+        if self.output_dir == self.site_dir:
+            self._site_changed(path)
+
+    def _site_changed(self, path):
+        """Note that the file at path in the site dir changed or was
+        deleted"""
+        self.changed_outputs.add(os.path.relpath(path, self.site_dir))
+
+    def _site_path(self, path):
+        """Return where a path in the output dir ends up in the site dir"""
+        if self.output_dir == self.site_dir:
+            return path
+        return util.path_join(self.site_dir, self._output_location(path))
+
+    def _link_or_copy(self, src, dest):
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+            profiler.add_bytes(os.path.getsize(dest))
+
+    def _move_to_site(self, delete):
+        """Move the files in the stage dir into the site dir, leaving alone
+        those that haven't changed"""
+        locations = set()
+        for path in util.recursive_file_list(self.output_dir):
+            location = self._output_location(path)
+            locations.add(location)
+            dest = util.path_join(self.site_dir, location)
+            if _same_files(path, dest):
+                continue
+            util.mkdir(os.path.dirname(dest))
+            os.replace(path, dest)
+            self._site_changed(dest)
         if delete:
-            shutil.rmtree(self.output_dir)
-            files_ = set(files_)
-            for root, dirs, files in os.walk(output_dir):
-                for file_ in files:
-                    path = os.path.join(root, file_)
-                    relative_name = path[len(output_dir) :]
-                    if relative_name not in files_:
-                        logger.info("Deleting: %s", path)
-                        os.remove(path)
-
-    def _copytree(self, src, dst, files_):
-        names = os.listdir(src)
-        util.mkdir(dst)
-        for name in names:
-            srcname = os.path.join(src, name)
-            dstname = os.path.join(dst, name)
-            if os.path.isdir(srcname):
-                self._copytree(srcname, dstname, files_)
-            else:
-                shutil.copy2(srcname, dstname)
-            relative_name = os.path.normpath(srcname[len(self.output_dir) :])
-            files_.append(relative_name)
-
-    def _write_files(self):
+            self._delete_other_files(locations)
+
+    def _delete_other_files(self, locations):
+        """Delete the files in the site dir, outside of the cache dir, that
+        aren't at one of locations"""
+        cache_dir = os.path.abspath(self.config.site.cache_dir)
+        for root, dirs, files in os.walk(self.site_dir):
+            for dir_ in list(dirs):
+                if os.path.abspath(os.path.join(root, dir_)) == cache_dir:
+                    dirs.remove(dir_)
+            for file_ in files:
+                path = os.path.join(root, file_)
+                if os.path.relpath(path, self.site_dir) not in locations:
+                    logger.info("Deleting: %s", path)
+                    os.remove(path)
+                    self._site_changed(path)
+
+    def _write_files(self, copy_static=True):
         """Write all files for the blog to _site
 
         Convert all templates to straight HTML
         Copy other non-template files directly"""
 
         for src, dest in _walk_files(self.output_dir, False):
+            if not copy_static and not src.endswith(".mako"):
+                continue
             if not os.path.exists(os.path.dirname(dest)):
                 util.mkdir(os.path.dirname(dest))
 
             if src.endswith(".mako"):
-                with open(src, encoding="utf-8") as t_file:
-                    template = Template(
-                        t_file.read(),
-                        lookup=self.template_lookup,
-                        uri=src,
-                        output_encoding=None,
-                        strict_undefined=True,
-                    )
-                    template.zf_meta = {"path": src}
-
-                with self._output_file(dest) as html_file:
-                    html = self.template_render(template)
-                    html_file.write(html)
+                location = self._output_location(dest)
+                key = self.manifest.output_key(src, {})
+                if self._reuse_output(location, key):
+                    continue
+                self._queue_render(self._write_page, location, key, src, dest)
             else:
                 self.copyfile(src, dest)
 
+    def _write_page(self, location, key, src, dest):
+        with self._rendering(location, key):
+            try:
+                template = self.template_lookup.get_page(src)
+            except mako_exceptions.MakoException:
+                rendered = self._render_failed(src, {})
+            else:
+                template.zf_meta = {"path": src}
+                rendered = self._render_to_file(template, {}, dest)
+        if not rendered:
+            self._output_failed(location)
+
+    @contextlib.contextmanager
+    def _rendering(self, location, key):
+        """Record the render of location in the build manifest, and name it
+        as the location of any render error within the block.
+
+        A render that fails within the block, even one nested inside the
+        template being rendered, fails the whole output; see
+        _render_to_file()."""
+        prev = self._location, self._failed
+        self._location, self._failed = location, False
+        try:
+            with profiler.timed("page", location):
+                with self.manifest.recording(location, key) as recorder:
+                    yield recorder
+        finally:
+            self._location, self._failed = prev
+
     def _init_filters_controllers(self):
         filter.init_filters()
         controller.init_controllers()
@@ -179,11 +711,35 @@ class Writer(object):
         """Run all the controllers in the _controllers directory"""
         controller.run_all()
 
-    def _output_file(self, name):
-        return open(name, "w", encoding="utf-8")
-
-    def template_render(self, template, attrs={}):
-        """Render a template"""
+    def _output_location(self, path):
+        """Return the location of an output path relative to the output
+        dir, as used in the build manifest"""
+        return os.path.relpath(path, self.output_dir)
+
+    def _reuse_output(self, location, key):
+        """Copy the previous build of location into the output dir, if the
+        manifest shows it was made from the same inputs.
+
+        Returns True if the output was reused."""
+        if not self.manifest.is_current(location, key):
+            return False
+        previous = util.path_join(self.site_dir, location)
+        if not os.path.isfile(previous):
+            return False
+        logger.debug("Unchanged, reusing: %s", location)
+        if self.output_dir != self.site_dir:
+            path = util.path_join(self.output_dir, location)
+            util.mkdir(os.path.dirname(path))
+            self._link_or_copy(previous, path)
+        self._written.add(location)
+        self.manifest.reuse(location)
+        return True
+
+    def template_render(self, template, attrs={}, out=None):
+        """Render a template, returning the output as a string, or writing
+        it to the file-like out and returning True.
+
+        Returns None if the template fails to render."""
         # Create a context object that is fresh for each template render
 
         prev = self.zf.template_context
@@ -197,25 +753,168 @@ class Writer(object):
                 self.zf.template_context.template_name = template.zf_meta[
                     "path"
                 ]
+                manifest.record_template(template.zf_meta["path"])
             attrs["zf"] = self.zf
             # Provide the template with other user defined namespaces:
             for name, obj in self.zf.config.site.template_vars.items():
                 attrs[name] = obj
             try:
-                return template.render_unicode(**attrs)
+                with profiler.timed(
+                    "template", self.zf.template_context.template_name
+                ):
+                    if out is None:
+                        return template.render_unicode(**attrs)
+                    _render_to_stream(template, attrs, out)
+                    return True
+            except RenderError:
+                raise
+            except NestedRenderError:
+                self._failed = True
+                return None
             except:
-                logger.error("Error rendering template %s", template.uri)
-                print(mako_exceptions.text_error_template().render())
+                return self._render_failed(
+                    self.zf.template_context.template_name, attrs
+                )
         finally:
             self.zf.template_context = prev
 
-    def materialize_template(self, template_name, location, attrs={}):
-        """Render a named template with attrs to a location in the _site dir"""
+    def _render_failed(self, template_name, attrs):
+        """Report the exception being handled as a failed render of
+        template_name, raising RenderError if the build should stop"""
+        logger.error("Error rendering template %s", template_name)
+        print(mako_exceptions.text_error_template().render())
+        exc = sys.exc_info()[1]
+        error = {
+            "template": template_name,
+            "location": self._location,
+            "context": sorted(
+                k
+                for k in attrs
+                if k != "zf" and k not in self.config.site.template_vars
+            ),
+            "error": "{0}: {1}".format(type(exc).__name__, exc),
+        }
+        self.render_errors.append(error)
+        self._failed = True
+        if self.config.site.render_errors == "stop":
+            raise RenderError(error)
+        return None
+
+    def _output_failed(self, location):
+        """Note that the output at location failed to render"""
+        if self.render_errors and self.render_errors[-1]["location"] is None:
+            self.render_errors[-1]["location"] = location
+        self.manifest.discard(location)
+
+    def materialize_template(
+        self, template_name, location, attrs={}, cache_key=None
+    ):
+        """Render a named template with attrs to a location in the _site dir
+
+        If cache_key is given, the rendered output is kept in the output
+        cache under it, and reused by any later build that renders with the
+        same cache_key and unchanged templates.  The cache_key must cover
+        everything the render depends on other than the templates."""
         logger.info("Materialize template: %s", location)
-        template = self.template_lookup.get_template(template_name)
-        template.output_encoding = "utf-8"
-        rendered = self.template_render(template, attrs)
         path = util.path_join(self.output_dir, location)
-        util.mkdir(os.path.split(path)[0])
-        with self._output_file(path) as f:
-            f.write(rendered)
+        location = self._output_location(path)
+        key = self.manifest.output_key(template_name, attrs)
+        if self._reuse_output(location, key):
+            return
+        if not self.config.site.incremental:
+            cache_key = None
+        self._queue_render(
+            self._write_template,
+            location,
+            key,
+            template_name,
+            path,
+            attrs,
+            cache_key,
+        )
+
+    def _write_template(
+        self, location, key, template_name, path, attrs, cache_key=None
+    ):
+        if cache_key is not None:
+            cache_key = manifest.digest(template_name, cache_key)
+            cached = self._cached_output(location, key, cache_key)
+            if cached is not None:
+                self._write_file(cached, path)
+                return
+        with self._rendering(location, key) as recorder:
+            try:
+                template = self.template_lookup.get_template(template_name)
+            except mako_exceptions.MakoException:
+                rendered = self._render_failed(template_name, attrs)
+            else:
+                template.output_encoding = "utf-8"
+                rendered = self._render_to_file(template, attrs, path)
+        if not rendered:
+            self._output_failed(location)
+            return
+        if cache_key is not None:
+            self.output_cache.set_file(
+                cache_key,
+                json.dumps(
+                    {
+                        "templates": self.manifest.outputs[location][
+                            "templates"
+                        ],
+                        "sources": sorted(recorder.sources),
+                    }
+                ),
+                path,
+            )
+
+    def _render_to_file(self, template, attrs, path):
+        """Render a template straight into the file at path in the output
+        dir, rather than building the whole output in memory first.
+
+        The file is left alone if the site dir already has the same
+        contents there.  Returns True if the template rendered."""
+        util.mkdir(os.path.dirname(path))
+        tmp = path + ".zeekofile-tmp"
+        rendered = False
+        try:
+            with open(tmp, "w", encoding="utf-8", buffering=64 * 1024) as out:
+                rendered = self.template_render(template, attrs, out)
+            # a template rendered from within this one failed
+            rendered = rendered and not self._failed
+        finally:
+            if not rendered:
+                os.remove(tmp)
+        if not rendered:
+            return False
+        profiler.add_bytes(os.path.getsize(tmp))
+        self._written.add(self._output_location(path))
+        site_path = self._site_path(path)
+        if _same_files(tmp, site_path):
+            os.remove(tmp)
+            if site_path != path:
+                self._link_or_copy(site_path, path)
+        else:
+            os.replace(tmp, path)
+            if self.output_dir == self.site_dir:
+                self._site_changed(path)
+        return True
+
+    def _cached_output(self, location, key, cache_key):
+        """Return the path of the output cached under cache_key, recording
+        it as the output at location, or None if there's none with unchanged
+        templates"""
+        cached = self.output_cache.get_file(cache_key)
+        if cached is None:
+            return None
+        text, path = cached
+        entry = json.loads(text)
+        for filename, file_digest in entry["templates"].items():
+            if self.manifest.file_digest(filename) != file_digest:
+                return None
+        logger.debug("Output cache hit: %s", location)
+        with self.manifest.recording(location, key):
+            for filename in entry["templates"]:
+                manifest.record_template(filename)
+            for source_digest in entry["sources"]:
+                manifest.record_source(source_digest)
+        return path